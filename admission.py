@@ -0,0 +1,292 @@
+import os
+import math
+import time
+import asyncio
+import zipfile
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager, asynccontextmanager
+from werkzeug.exceptions import TooManyRequests
+from pypdf import PdfReader
+
+# Configuration
+OCR_BUDGET = int(os.getenv("OCR_BUDGET", 64))  # scanned pages being processed at once
+# LLM-bound cost units in flight at once. Budgets are per controller; this sizes
+# the sync server, whose worker threads block on OpenRouter. The async server
+# has its own controller and budget (ASYNC_LLM_BUDGET in async_app.py).
+LLM_BUDGET = int(os.getenv("LLM_BUDGET", 16))
+MAX_QUEUE_DEPTH = int(os.getenv("MAX_QUEUE_DEPTH", 50))  # waiting requests per work class
+MAX_QUEUED_PER_SESSION = int(os.getenv("MAX_QUEUED_PER_SESSION", 5))
+MAX_QUEUE_WAIT = float(os.getenv("MAX_QUEUE_WAIT", 60))  # seconds before giving up with 429
+PAGES_PER_UNIT = 50  # LLM-bound pages that count as one cost unit
+SCANNED_BYTES_PER_PAGE = 150 * 1024  # PDFs heavier than this per page are likely scans
+BYTES_PER_PAGE = 50 * 1024  # page estimate for files without a page count
+EMA_WEIGHT = 0.2
+
+class RequestCost:
+    """Estimated cost of one analysis request"""
+
+    def __init__(self, pages=0, ocr_pages=0, size=0):
+        self.pages = pages
+        self.ocr_pages = ocr_pages
+        self.size = size
+
+    @property
+    def work_class(self):
+        return "ocr" if self.ocr_pages else "llm"
+
+    @property
+    def units(self):
+        if self.work_class == "ocr":
+            return self.ocr_pages
+        return max(1, math.ceil(self.pages / PAGES_PER_UNIT))
+
+    def as_dict(self):
+        return {"pages": self.pages, "ocr_pages": self.ocr_pages, "bytes": self.size,
+                "work_class": self.work_class, "units": self.units}
+
+def source_size(source):
+    """Size in bytes of a path or seekable stream"""
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    position = source.tell()
+    source.seek(0, os.SEEK_END)
+    size = source.tell()
+    source.seek(position)
+    return size
+
+def estimate_pdf_pages(source, size):
+    """(pages, likely scanned pages) of a PDF, reading only its page tree"""
+    try:
+        pages = len(PdfReader(source).pages)
+    except Exception as e:
+        pages = max(1, size // BYTES_PER_PAGE)
+    finally:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+    pages = max(1, pages)
+    return pages, pages if size / pages > SCANNED_BYTES_PER_PAGE else 0
+
+def estimate_cost(uploads, extracted=False):
+    """Estimate the cost of a batch of (source, filename) uploads.
+
+    With extracted=True the text already exists, so no OCR is left to do.
+    """
+    cost = RequestCost()
+    for source, filename in uploads:
+        size = source_size(source)
+        cost.size += size
+        name = filename.lower()
+
+        if name.endswith('.zip'):
+            # Member headers are only an estimate; real limits apply while unpacking
+            try:
+                with zipfile.ZipFile(source) as archive:
+                    for info in archive.infolist():
+                        pages = max(1, info.file_size // BYTES_PER_PAGE)
+                        cost.pages += pages
+                        if info.filename.lower().endswith('.pdf') and not extracted and \
+                                info.file_size / pages > SCANNED_BYTES_PER_PAGE:
+                            cost.ocr_pages += pages
+            except zipfile.BadZipFile:
+                cost.pages += 1
+            finally:
+                if hasattr(source, 'seek'):
+                    source.seek(0)
+        elif name.endswith('.pdf') and not extracted:
+            pages, ocr_pages = estimate_pdf_pages(source, size)
+            cost.pages += pages
+            cost.ocr_pages += ocr_pages
+        else:
+            cost.pages += max(1, size // BYTES_PER_PAGE)
+    return cost
+
+class Ticket:
+    """A request waiting for (or holding) a share of a work class budget"""
+
+    def __init__(self, session_id, work_class, units):
+        self.session_id = session_id
+        self.work_class = work_class
+        self.units = units
+        self.enqueued_at = time.monotonic()
+        self.granted_at = None
+        self._event = threading.Event()
+        self._callbacks = []
+
+    @property
+    def granted(self):
+        return self._event.is_set()
+
+    def grant(self):
+        self.granted_at = time.monotonic()
+        self._event.set()
+        for callback in self._callbacks:
+            callback()
+
+    def wait(self, timeout):
+        return self._event.wait(timeout)
+
+    async def wait_async(self, timeout):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+        self._callbacks.append(wake)
+        if self.granted:
+            return True
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return self.granted
+
+class WorkClass:
+    """Budget and per-session queues for one class of work"""
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.capacity = capacity
+        self.in_flight = 0
+        self.queues = OrderedDict()  # session_id -> deque of tickets, in round-robin order
+        self.depth = 0
+        self.avg_wait = 0.0
+        self.max_wait = 0.0
+        self.avg_unit_time = 1.0  # seconds of service per cost unit
+        self.rejected = 0
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "queue_depth": self.depth,
+            "queued_sessions": len(self.queues),
+            "avg_wait_seconds": round(self.avg_wait, 2),
+            "max_wait_seconds": round(self.max_wait, 2),
+            "rejected": self.rejected
+        }
+
+class AdmissionController:
+    """Bounded, per-session fair admission in front of the analysis pipeline"""
+
+    def __init__(self, budgets=None):
+        budgets = budgets or {"ocr": OCR_BUDGET, "llm": LLM_BUDGET}
+        self.classes = {name: WorkClass(name, capacity) for name, capacity in budgets.items()}
+        self._lock = threading.Lock()
+
+    def estimate_wait(self, work, units):
+        """Rough seconds until a new request of this size would start"""
+        queued_units = sum(t.units for queue in work.queues.values() for t in queue)
+        backlog = work.in_flight + queued_units + units - work.capacity
+        return max(1, math.ceil(max(backlog, 0) * work.avg_unit_time / work.capacity))
+
+    def submit(self, session_id, cost):
+        """Queue a request, or fail fast with 429 when its class is saturated"""
+        with self._lock:
+            work = self.classes[cost.work_class]
+            # A request bigger than the whole budget runs alone rather than never
+            units = min(cost.units, work.capacity)
+            session_queue = work.queues.get(session_id, ())
+
+            if work.depth >= MAX_QUEUE_DEPTH or len(session_queue) >= MAX_QUEUED_PER_SESSION or \
+                    self.estimate_wait(work, units) > MAX_QUEUE_WAIT:
+                work.rejected += 1
+                raise TooManyRequests(
+                    f"Server busy with {work.name.upper()} work, retry later",
+                    retry_after=self.estimate_wait(work, units)
+                )
+
+            ticket = Ticket(session_id, work.name, units)
+            work.queues.setdefault(session_id, deque()).append(ticket)
+            work.depth += 1
+            self._dispatch(work)
+            return ticket
+
+    def _dispatch(self, work):
+        """Grant queued tickets round-robin across sessions while budget allows"""
+        while work.queues:
+            session_id, queue = next(iter(work.queues.items()))
+            ticket = queue[0]
+            # Head of line waits for room so large requests are not starved
+            if work.in_flight and work.in_flight + ticket.units > work.capacity:
+                return
+
+            queue.popleft()
+            work.depth -= 1
+            if queue:
+                work.queues.move_to_end(session_id)
+            else:
+                del work.queues[session_id]
+
+            work.in_flight += ticket.units
+            ticket.grant()
+            wait = ticket.granted_at - ticket.enqueued_at
+            work.avg_wait += EMA_WEIGHT * (wait - work.avg_wait)
+            work.max_wait = max(work.max_wait, wait)
+
+    def cancel(self, ticket):
+        """Withdraw a ticket that gave up waiting"""
+        with self._lock:
+            work = self.classes[ticket.work_class]
+            if ticket.granted:
+                self._release(work, ticket)
+                return
+            queue = work.queues.get(ticket.session_id)
+            if queue and ticket in queue:
+                queue.remove(ticket)
+                work.depth -= 1
+                if not queue:
+                    del work.queues[ticket.session_id]
+            work.rejected += 1
+
+    def release(self, ticket):
+        with self._lock:
+            self._release(self.classes[ticket.work_class], ticket)
+
+    def _release(self, work, ticket):
+        work.in_flight -= ticket.units
+        service = (time.monotonic() - ticket.granted_at) / ticket.units
+        work.avg_unit_time += EMA_WEIGHT * (service - work.avg_unit_time)
+        self._dispatch(work)
+
+    def timed_out(self, ticket):
+        """Cancel a ticket that waited too long and build the 429 for it"""
+        self.cancel(ticket)
+        work = self.classes[ticket.work_class]
+        return TooManyRequests(
+            f"Timed out waiting for {work.name.upper()} capacity, retry later",
+            retry_after=self.estimate_wait(work, ticket.units)
+        )
+
+    @contextmanager
+    def admit(self, session_id, cost):
+        """Hold a share of the budget for the duration of a sync request"""
+        ticket = self.submit(session_id, cost)
+        if not ticket.wait(MAX_QUEUE_WAIT):
+            raise self.timed_out(ticket)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @asynccontextmanager
+    async def admit_async(self, session_id, cost):
+        """Hold a share of the budget for the duration of an async request"""
+        ticket = self.submit(session_id, cost)
+        try:
+            granted = await ticket.wait_async(MAX_QUEUE_WAIT)
+        except BaseException:
+            # Cancelled while queued (client went away): withdraw the ticket, or
+            # hand back the budget if it was granted in the meantime
+            self.cancel(ticket)
+            raise
+        if not granted:
+            raise self.timed_out(ticket)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self):
+        with self._lock:
+            return {name: work.stats() for name, work in self.classes.items()}
@@ -1,14 +1,18 @@
 import os
 import json
-from turtle import st
-from urllib import response
 import yaml
 import uuid
+import hashlib
 import tempfile
 import shutil
+import threading
+import time
+import sqlite3
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, abort
-from werkzeug.exceptions import HTTPException
+from flask import Flask, Response, request, jsonify, abort
+from werkzeug.exceptions import HTTPException, TooManyRequests
 from werkzeug.utils import secure_filename
 from flask_cors import CORS
 import fitz  # PyMuPDF
@@ -17,12 +21,22 @@ from PIL import Image
 import io
 import pandas as pd
 import requests  # For OpenRouter API calls
+from pypdf import PdfReader
+import docx2txt
 
 # LangChain imports (still used for text processing)
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 
+from exports import EXPORT_FORMATS, result_hash, render_export, iter_export
+from structured_output import (field_name, build_response_schema, repair_json,
+                               missing_fields, merge_results)
+from local_extraction import pre_extract
+from text_spool import SPILL_THRESHOLD, TextSpool, memory_usage
+from admission import AdmissionController, estimate_cost
+from model_routing import ModelRouter
+import search_index
+
 # Load environment variables
 from dotenv import load_dotenv
 load_dotenv()
@@ -35,30 +49,88 @@ CORS(app, origins=["http://localhost:8501", "http://127.0.0.1:8501"],
 # Configuration
 CHUNK_SIZE = 2000
 CHUNK_OVERLAP = 400
+PROMPT_TEXT_LIMIT = 15000  # characters of document text sent to the LLM
 SUPPORTED_DOC_TYPES = [".pdf", ".docx", ".txt", ".xlsx", ".csv"]
 SUPPORTED_CONFIG_TYPES = [".yaml", ".yml", ".json"]
 MIN_TEXT_LENGTH = 50
 MAX_CONFIG_SIZE = 1 * 1024 * 1024  # 1MB
 SESSION_EXPIRE_HOURS = 2
+MAX_DOCUMENT_SIZE = 100 * 1024 * 1024  # 100MB per document, matches the UI
+MAX_REQUEST_SIZE = int(os.getenv("MAX_REQUEST_SIZE", 1024 * 1024 * 1024))  # 1GB per multipart batch
+
+# ZIP archive limits, enforced while members are decompressed
+MAX_ZIP_MEMBERS = 100
+MAX_ZIP_TOTAL_SIZE = 500 * 1024 * 1024  # 500MB uncompressed
+MAX_ZIP_COMPRESSION_RATIO = 100
+ZIP_READ_CHUNK = 1024 * 1024  # 1MB
+ZIP_MEMBER_MEMORY = 8 * 1024 * 1024  # larger members are decompressed to a temp file
+
+# Chunked upload configuration
+UPLOAD_ROOT = os.getenv("UPLOAD_ROOT", os.path.join(tempfile.gettempdir(), "mvp_uploads"))
+MAX_UPLOAD_CHUNK = 16 * 1024 * 1024  # 16MB per PUT
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", os.cpu_count() or 2))
+
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_SIZE
 
 # In-memory session store (replace with Redis in production)
 sessions = {}
+stored_results = {}  # result hash -> analysis data, kept for exports
+uploads_lock = threading.Lock()
+admission = AdmissionController()
+router = ModelRouter()
+
+# Completed chunked uploads are extracted here while the rest of the batch uploads
+extraction_executor = ThreadPoolExecutor(max_workers=EXTRACTION_WORKERS)
 
 # OpenRouter configuration
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
-OPENROUTER_MODEL = "anthropic/claude-3-opus"  # Can be changed to any supported model
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+OPENROUTER_MODEL = "anthropic/claude-3-opus"  # Default when no route picks a model
+OPENROUTER_TIMEOUT = 300  # seconds, matches the UI's analysis timeout
+# Ask for schema-constrained JSON; disable for models without structured output
+OPENROUTER_STRUCTURED_OUTPUT = os.getenv("OPENROUTER_STRUCTURED_OUTPUT", "1") == "1"
+MAX_REPAIR_ROUNDS = 1  # follow-up requests for fields missing from a reply
+# Resolve concise fields (IDs, dates, amounts) locally before calling the LLM
+LOCAL_EXTRACTION = os.getenv("LOCAL_EXTRACTION", "1") == "1"
 
 def allowed_document_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in {'pdf', 'docx', 'txt', 'xlsx', 'csv'}
 
+def is_zip_file(filename):
+    return filename.lower().endswith('.zip')
+
 def allowed_config_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in {'yaml', 'yml', 'json'}
 
-def extract_text_with_ocr(pdf_path):
+class ArchiveError(ValueError):
+    """Raised when an uploaded ZIP archive is invalid or exceeds its limits"""
+
+class AnalysisError(ValueError):
+    """Raised when the first LLM request of an analysis fails on every routed model"""
+    
+    def __init__(self, message, analysis_info):
+        super().__init__(message)
+        self.analysis_info = analysis_info
+    
+    def body(self):
+        """JSON body of the 500 response, with the models that were tried"""
+        return {"status": "error", "message": str(self), "analysis": self.analysis_info}
+
+def open_pdf(pdf_source):
+    """Open a PDF from a path, bytes or binary stream"""
+    if isinstance(pdf_source, (str, os.PathLike)):
+        return fitz.open(pdf_source)
+    if hasattr(pdf_source, 'read'):
+        pdf_source.seek(0)
+        # PyMuPDF reads BytesIO in place; other streams have to be read out
+        if not isinstance(pdf_source, io.BytesIO):
+            pdf_source = pdf_source.read()
+    return fitz.open(stream=pdf_source, filetype="pdf")
+
+def extract_text_with_ocr(pdf_source):
     """Extract text from PDF with fallback to OCR"""
-    doc = fitz.open(pdf_path)
+    doc = open_pdf(pdf_source)
     full_text = ""
     
     for page_num in range(len(doc)):
@@ -80,73 +152,109 @@ def extract_text_with_ocr(pdf_path):
     doc.close()
     return full_text.strip()
 
-def parse_config_file(file):
-    """Parse and validate config file"""
+def validate_config(config):
+    """Validate parsed config structure"""
+    if not isinstance(config, dict):
+        raise ValueError("Config must be a dictionary")
+    
+    if 'fields' not in config:
+        raise ValueError("Config must contain 'fields' key")
+    
+    if not isinstance(config['fields'], list):
+        raise ValueError("Fields must be a list")
+    
+    # Validate each field
+    for field in config['fields']:
+        if not isinstance(field, dict):
+            raise ValueError("Each field must be a dictionary")
+        if 'keywords' not in field:
+            raise ValueError("Field missing 'keywords' list")
+    
+    return config
+
+def parse_config_content(content, filename):
+    """Parse and validate raw config bytes"""
     try:
-        # Check file size
-        file.seek(0, os.SEEK_END)
-        size = file.tell()
-        file.seek(0)
-        if size > MAX_CONFIG_SIZE:
+        if len(content) > MAX_CONFIG_SIZE:
             raise ValueError(f"Config file exceeds {MAX_CONFIG_SIZE/1024/1024}MB limit")
         
-        # Secure temporary file handling
-        with tempfile.NamedTemporaryFile(delete=False) as tmp:
-            file.save(tmp.name)
-            with open(tmp.name, 'r') as f:
-                if file.filename.lower().endswith('.json'):
-                    config = json.load(f)
-                else:
-                    config = yaml.safe_load(f)
-                
-                # Validate config structure
-                if not isinstance(config, dict):
-                    raise ValueError("Config must be a dictionary")
-                
-                if 'fields' not in config:
-                    raise ValueError("Config must contain 'fields' key")
-                
-                if not isinstance(config['fields'], list):
-                    raise ValueError("Fields must be a list")
-                
-                # Validate each field
-                for field in config['fields']:
-                    if not isinstance(field, dict):
-                        raise ValueError("Each field must be a dictionary")
-                    if 'keywords' not in field:
-                        raise ValueError("Field missing 'keywords' list")
-                    
-                return config
+        text = content.decode('utf-8') if isinstance(content, bytes) else content
+        if filename.lower().endswith('.json'):
+            config = json.loads(text)
+        else:
+            config = yaml.safe_load(text)
+        
+        return validate_config(config)
                 
     except (yaml.YAMLError, json.JSONDecodeError) as e:
         raise ValueError(f"Invalid config format: {str(e)}")
     except Exception as e:
         raise ValueError(f"Config processing error: {str(e)}")
 
-def query_openrouter(prompt, session_id=None):
-    """Call OpenRouter API with the given prompt"""
+def parse_config_file(file):
+    """Parse and validate config file"""
+    # Check file size before reading it into memory
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(0)
+    if size > MAX_CONFIG_SIZE:
+        raise ValueError(f"Config file exceeds {MAX_CONFIG_SIZE/1024/1024}MB limit")
+    
+    return parse_config_content(file.read(), file.filename)
+
+def build_openrouter_request(prompt, schema=None, model=None):
+    """Build headers and payload for an OpenRouter chat completion"""
     headers = {
         "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
         "Content-Type": "application/json"
     }
     
     payload = {
-        "model": OPENROUTER_MODEL,
+        "model": model or OPENROUTER_MODEL,
         "messages": [{"role": "user", "content": prompt}],
         "temperature": 0.3
     }
     
+    if schema and OPENROUTER_STRUCTURED_OUTPUT:
+        payload["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": "extraction_results", "strict": True, "schema": schema}
+        }
+    
+    return headers, payload
+
+def query_openrouter(prompt, session_id=None, schema=None, model=None, timeout=None):
+    """Call OpenRouter API with the given prompt"""
+    headers, payload = build_openrouter_request(prompt, schema, model)
+    
     try:
-        response = requests.post(OPENROUTER_API_URL, headers=headers, json=payload)
+        response = requests.post(OPENROUTER_API_URL, headers=headers, json=payload,
+                                 timeout=timeout or OPENROUTER_TIMEOUT)
         response.raise_for_status()
         return response.json()['choices'][0]['message']['content']
     except Exception as e:
         raise ValueError(f"OpenRouter API error: {str(e)}")
 
+def query_with_plan(prompt, schema, plan, session_id=None):
+    """Call OpenRouter following a route plan, falling back to the next model on failure"""
+    error = None
+    for model in plan.models:
+        started = time.monotonic()
+        try:
+            reply = query_openrouter(prompt, session_id, schema if plan.structured_output else None,
+                                     model, plan.timeout)
+        except ValueError as e:
+            plan.record(model, time.monotonic() - started, e)
+            error = e
+            continue
+        plan.record(model, time.monotonic() - started)
+        return reply
+    raise error
+
 def build_dynamic_prompt(fields, text):
     """Generate analysis prompt based on fields"""
     fields_section = "\n".join(
-        f"- {field.get('name', f'field_{i+1}')}: "
+        f"- {field_name(field, i)}: "
         f"Keywords: {', '.join(field.get('keywords', []))}\n"
         f"  Response type: {field.get('response_type', 'auto')}\n"
         f"  Description: {field.get('description', 'N/A')}"
@@ -159,7 +267,7 @@ FIELDS TO EXTRACT:
 {fields_section}
 
 DOCUMENT CONTENT:
-{text[:15000]}
+{text[:PROMPT_TEXT_LIMIT]}
 
 INSTRUCTIONS:
 1. For each field, determine appropriate response format:
@@ -179,6 +287,412 @@ INSTRUCTIONS:
 
 OUTPUT:"""
 
+def load_document(source, filename):
+    """Extract LangChain documents from a path or binary stream based on file type"""
+    # Process based on file type
+    if filename.lower().endswith('.pdf'):
+        try:
+            reader = PdfReader(source)
+            docs = [
+                Document(page_content=page.extract_text() or "",
+                         metadata={"source": filename, "page": i})
+                for i, page in enumerate(reader.pages)
+            ]
+            if sum(len(d.page_content) for d in docs) < MIN_TEXT_LENGTH * len(docs):
+                full_text = extract_text_with_ocr(source)
+                if full_text.strip():
+                    docs = [Document(page_content=full_text, metadata={"source": filename})]
+        except Exception as e:
+            full_text = extract_text_with_ocr(source)
+            docs = [Document(page_content=full_text, metadata={"source": filename})] if full_text.strip() else []
+        return docs
+        
+    elif filename.lower().endswith('.docx'):
+        content = docx2txt.process(source)
+        return [Document(page_content=content, metadata={"source": filename})]
+    elif filename.lower().endswith('.txt'):
+        if hasattr(source, 'read'):
+            content = source.read()
+        else:
+            with open(source, 'rb') as f:
+                content = f.read()
+        content = content.decode('utf-8', errors='replace')
+        return [Document(page_content=content, metadata={"source": filename})]
+    elif filename.lower().endswith('.csv'):
+        df = pd.read_csv(source)
+        content = df.to_markdown(index=False)
+        print("Extracted CSV content:\n", content[:300])
+        return [Document(page_content=content, metadata={"source": filename})]
+
+    elif filename.lower().endswith('.xlsx'):
+        df = pd.read_excel(source, engine='openpyxl')
+        # 🧹 Clean: remove fully empty rows/columns
+        df.dropna(how='all', inplace=True)
+        df.dropna(axis=1, how='all', inplace=True)
+
+        if not df.empty:
+            try:
+                content = df.to_markdown(index=False)
+            except ImportError:
+                content = df.to_string(index=False)
+
+            print("Extracted Excel content:\n", content[:300])
+            return [Document(page_content=content, metadata={"source": filename})]
+        else:
+            print("WARNING: Excel sheet is empty after cleaning.")
+            return []
+    
+    return []
+
+def read_zip_member(archive, info, total_read):
+    """Decompress one member, enforcing size and ratio limits as bytes arrive.
+
+    Returns (source, size): an in-memory stream for members up to
+    ZIP_MEMBER_MEMORY, else the path of a temp file holding the member.
+    Release it with release_zip_member.
+    """
+    target = io.BytesIO()
+    path = None
+    size = 0
+    
+    try:
+        with archive.open(info) as member:
+            while True:
+                chunk = member.read(ZIP_READ_CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                
+                # Header sizes can lie, so check what actually comes out of the decompressor
+                if size > MAX_DOCUMENT_SIZE:
+                    raise ArchiveError(f"{info.filename} exceeds {MAX_DOCUMENT_SIZE//1024//1024}MB limit")
+                if total_read + size > MAX_ZIP_TOTAL_SIZE:
+                    raise ArchiveError(f"ZIP exceeds {MAX_ZIP_TOTAL_SIZE//1024//1024}MB uncompressed limit")
+                if size > max(info.compress_size, 1) * MAX_ZIP_COMPRESSION_RATIO:
+                    raise ArchiveError(f"{info.filename} exceeds compression ratio limit")
+                
+                if path is None and size > ZIP_MEMBER_MEMORY:
+                    # Too big to hold in memory: move what we have to disk and carry on there
+                    fd, path = tempfile.mkstemp(prefix="zip_member_")
+                    spilled = os.fdopen(fd, 'wb')
+                    spilled.write(target.getvalue())
+                    target.close()
+                    target = spilled
+                target.write(chunk)
+    except BaseException:
+        target.close()
+        if path:
+            os.remove(path)
+        raise
+    
+    if path:
+        target.close()
+        return path, size
+    target.seek(0)
+    return target, size
+
+def release_zip_member(source):
+    """Free a member returned by read_zip_member"""
+    if isinstance(source, io.BytesIO):
+        source.close()
+    elif os.path.exists(source):
+        os.remove(source)
+
+def iter_zip_members(source):
+    """Yield (filename, member) for each supported document in a ZIP, one at a time"""
+    try:
+        archive = zipfile.ZipFile(source)
+    except zipfile.BadZipFile:
+        raise ArchiveError("Invalid ZIP file")
+    
+    with archive:
+        members = 0
+        total_read = 0
+        
+        for info in archive.infolist():
+            # Skip directories, hidden files and macOS metadata
+            filename = os.path.basename(info.filename)
+            if info.is_dir() or not filename or filename.startswith('.') or \
+                    info.filename.startswith('__MACOSX/'):
+                continue
+            
+            members += 1
+            if members > MAX_ZIP_MEMBERS:
+                raise ArchiveError(f"ZIP contains too many files (max {MAX_ZIP_MEMBERS})")
+            if not allowed_document_file(filename):
+                continue
+            
+            member, size = read_zip_member(archive, info, total_read)
+            total_read += size
+            yield secure_filename(filename), member
+
+def iter_upload(source, filename):
+    """Yield documents from an upload one at a time, expanding ZIP archives member by member.
+
+    Unreadable files are skipped; only ArchiveError propagates.
+    """
+    if not is_zip_file(filename):
+        try:
+            yield from load_document(source, filename)
+        except Exception as e:
+            pass
+        return
+    
+    for member_name, member in iter_zip_members(source):
+        try:
+            documents = load_document(member, member_name)
+        except Exception as e:
+            continue
+        finally:
+            release_zip_member(member)
+        yield from documents
+
+def is_useful_chunk(content):
+    """Filter out noise such as form lines and tables of contents"""
+    return (len(content) > 100 and 
+            not content.count('_') > len(content) * 0.3 and
+            not content.count('.') > len(content) * 0.1)
+
+def build_text_spool(documents, spill_threshold=SPILL_THRESHOLD, directory=None):
+    """Stream documents through splitting and filtering into a TextSpool"""
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP
+    )
+    spool = TextSpool(spill_threshold, directory)
+    
+    try:
+        # One document at a time, so only its splits are ever held in memory
+        for document in documents:
+            spool.document_count += 1
+            for content in text_splitter.split_text(document.page_content):
+                content = content.strip()
+                if is_useful_chunk(content):
+                    spool.write(content, document.metadata)
+    except BaseException:
+        spool.close()
+        raise
+    
+    return spool.finalize()
+
+def spool_upload(source, filename, directory=None):
+    """Extract, split and filter one upload into a disk-backed spool"""
+    return build_text_spool(iter_upload(source, filename), 0, directory)
+
+def store_result(data):
+    """Keep a result for later exports, addressed by its content hash"""
+    result_id = result_hash(data)
+    stored_results[result_id] = {
+        "data": data,
+        "expiry": datetime.now() + timedelta(hours=SESSION_EXPIRE_HOURS)
+    }
+    return result_id
+
+def get_stored_result(result_id):
+    """Return a stored result, aborting if it is unknown or expired"""
+    stored = stored_results.get(result_id)
+    if not stored or datetime.now() > stored['expiry']:
+        abort(404, "Result not found")
+    return stored['data']
+
+def build_export_response(result_id, export_format):
+    """Headers and metadata shared by the sync and async export endpoints"""
+    if export_format not in EXPORT_FORMATS:
+        abort(400, f"Unsupported export format. Use one of: {', '.join(EXPORT_FORMATS)}")
+    
+    data = get_stored_result(result_id)
+    rendered = render_export(data, export_format, result_id)
+    _, mime, extension = EXPORT_FORMATS[export_format]
+    headers = {
+        "Content-Disposition": f"attachment; filename=extraction_results.{extension}",
+        "Content-Length": str(len(rendered)),
+        "ETag": f'"{result_id[:16]}-{export_format}"'
+    }
+    return rendered, mime, headers
+
+def build_analysis_result(parsed, llm_response, spool, analysis_info, local_results=()):
+    """Turn the (repaired) LLM reply into the /upload_documents response body.
+
+    local_results are only needed when the reply could not be parsed; otherwise
+    they are already merged into parsed.
+    """
+    # Spilled/text_bytes describe this request; the RSS figures are process-wide
+    memory = dict(memory_usage(), spilled=spool.spilled, text_bytes=spool.text_bytes)
+    if parsed is None:
+        return {
+            "status": "partial_success",
+            "raw_response": llm_response,
+            "message": "Could not parse LLM response as JSON",
+            "local_results": list(local_results),
+            "analysis": analysis_info,
+            "memory": memory
+        }
+    
+    text_sample = spool.head(501)
+    if len(text_sample) > 500:
+        text_sample = text_sample[:500] + "..."
+    
+    return {
+        "status": "success",
+        "data": parsed,
+        "result_id": store_result(parsed),
+        "analysis": analysis_info,
+        "memory": memory,
+        "text_sample": text_sample
+    }
+
+def index_batch(session_id, spool):
+    """Add a batch's chunks to the session's search index; None if indexing failed"""
+    try:
+        return search_index.index_spool(session_id, spool, sessions[session_id]['expiry'])
+    except sqlite3.Error as e:
+        print(f"WARNING: Could not index session text: {e}")
+        return None
+
+def analysis_steps(fields, spool, batch_id=None):
+    """Drive one analysis: yields (prompt, schema, route plan) and expects the LLM reply back.
+
+    Written as a generator so the sync and async servers share the repair
+    logic and only differ in how they call OpenRouter. A reply of None means
+    the follow-up request failed. Yields nothing if every field was resolved
+    locally.
+    """
+    field_order = {field_name(field, i): i for i, field in enumerate(fields)}
+    if LOCAL_EXTRACTION:
+        local_results, fields = pre_extract(fields, spool.iter_chunks(), CHUNK_OVERLAP)
+    else:
+        local_results = []
+    analysis_info = {"truncated": False, "re_requested_fields": [], "missing_fields": [],
+                     "local_fields": [item['field'] for item in local_results], "routing": []}
+    
+    # Everything resolved locally: skip the LLM entirely
+    if not fields:
+        return build_analysis_result({"results": local_results}, None, spool, analysis_info)
+    
+    def prompt_text_for(request_fields):
+        # Text that does not fit the prompt: send the chunks the index ranks highest
+        if batch_id and spool.text_bytes > PROMPT_TEXT_LIMIT:
+            try:
+                selected = search_index.select_chunks(batch_id, request_fields, PROMPT_TEXT_LIMIT)
+            except sqlite3.Error:
+                selected = None
+            if selected:
+                analysis_info["prompt_text"] = "index"
+                return selected
+        analysis_info["prompt_text"] = "head"
+        return spool.head(PROMPT_TEXT_LIMIT)
+    
+    def llm_request(request_fields):
+        prompt = build_dynamic_prompt(request_fields, prompt_text_for(request_fields))
+        plan = router.plan(prompt, request_fields, spool.text_bytes)
+        analysis_info["routing"].append(plan)
+        return prompt, build_response_schema(request_fields), plan
+    
+    first_request = llm_request(fields)
+    try:
+        llm_response = yield first_request
+    except ValueError as e:
+        # Thrown in when the first request failed on every model
+        analysis_info["routing"] = [plan.report() for plan in analysis_info["routing"]]
+        raise AnalysisError(f"Analysis failed: {e}", analysis_info) from e
+    parsed, analysis_info["truncated"] = repair_json(llm_response)
+    
+    # Re-request only the fields the reply lacks instead of the whole analysis
+    for _ in range(MAX_REPAIR_ROUNDS if parsed is not None else 0):
+        missing = missing_fields(parsed, fields)
+        if not missing:
+            break
+        analysis_info["re_requested_fields"].extend(field['name'] for field in missing)
+        retry_response = yield llm_request(missing)
+        extra, _ = repair_json(retry_response or "")
+        parsed = merge_results(parsed, extra)
+    
+    analysis_info["routing"] = [plan.report() for plan in analysis_info["routing"]]
+    if parsed is None:
+        # Nothing usable from the LLM, but what was resolved locally still stands
+        analysis_info["missing_fields"] = [field['name'] for field in fields]
+        return build_analysis_result(None, llm_response, spool, analysis_info, local_results)
+    
+    analysis_info["missing_fields"] = [field['name'] for field in missing_fields(parsed, fields)]
+    parsed = merge_results(parsed, {"results": local_results})
+    # Keep results in config order regardless of where they were resolved
+    parsed['results'].sort(key=lambda item: field_order.get(item.get('field'), len(field_order)))
+    return build_analysis_result(parsed, llm_response, spool, analysis_info)
+
+def run_analysis(fields, spool, session_id=None, batch_id=None):
+    """Run the analysis steps against OpenRouter synchronously"""
+    steps = analysis_steps(fields, spool, batch_id)
+    try:
+        prompt, schema, plan = next(steps)
+    except StopIteration as done:
+        return done.value
+    # The first request must succeed (the steps turn its failure into an
+    # AnalysisError); follow-ups are best effort
+    try:
+        reply = query_with_plan(prompt, schema, plan, session_id)
+    except ValueError as e:
+        steps.throw(e)
+    
+    while True:
+        try:
+            prompt, schema, plan = steps.send(reply)
+        except StopIteration as done:
+            return done.value
+        try:
+            reply = query_with_plan(prompt, schema, plan, session_id)
+        except ValueError:
+            reply = None
+
+def admission_report(cost, ticket):
+    """Cost estimate and queue wait of an admitted request"""
+    return dict(cost.as_dict(), queue_wait_seconds=round(ticket.granted_at - ticket.enqueued_at, 3))
+
+def get_active_config(session_id):
+    """Return the config for a live session, aborting if it is unknown or expired"""
+    if session_id not in sessions or datetime.now() > sessions[session_id]['expiry']:
+        abort(400, "Invalid or expired session ID")
+    
+    return sessions[session_id]['config']
+
+def purge_expired_sessions():
+    """Drop expired sessions, their chunked uploads and expired stored results"""
+    now = datetime.now()
+    with uploads_lock:
+        expired = [sid for sid, data in sessions.items() if now > data['expiry']]
+        for session_id in expired:
+            sessions.pop(session_id, None)
+    # Upload spools are not closed here since a request that started before the
+    # session expired may still be reading them; maps it already opened stay
+    # valid after the files are removed and are released with the spools.
+    for session_id in expired:
+        shutil.rmtree(os.path.join(UPLOAD_ROOT, session_id), ignore_errors=True)
+    for result_id in [rid for rid, data in list(stored_results.items()) if now > data['expiry']]:
+        stored_results.pop(result_id, None)
+    try:
+        search_index.purge_expired()
+    except sqlite3.Error as e:
+        print(f"WARNING: Could not purge search index: {e}")
+
+def create_session(config):
+    """Store a parsed config under a fresh session ID"""
+    session_id = str(uuid.uuid4())
+    expiry = datetime.now() + timedelta(hours=SESSION_EXPIRE_HOURS)
+    
+    purge_expired_sessions()
+    with uploads_lock:
+        sessions[session_id] = {
+            "config": config,
+            "expiry": expiry,
+            "uploads": {},
+            "upload_hashes": {}
+        }
+    
+    return {
+        "status": "success",
+        "session_id": session_id,
+        "expires_at": expiry.isoformat()
+    }
+
 @app.route('/upload_config', methods=['POST'])
 def upload_config():
     """First step: Upload configuration file"""
@@ -191,157 +705,323 @@ def upload_config():
     
     try:
         config = parse_config_file(config_file)
-        session_id = str(uuid.uuid4())
-        expiry = datetime.now() + timedelta(hours=SESSION_EXPIRE_HOURS)
+        return jsonify(create_session(config))
+    except ValueError as e:
+        abort(400, str(e))
+
+def file_sha256(path):
+    """Hash a file on disk without loading it into memory"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(ZIP_READ_CHUNK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def upload_status(upload):
+    """Public view of a chunked upload"""
+    return {
+        "upload_id": upload['upload_id'],
+        "filename": upload['filename'],
+        "size": upload['size'],
+        "sha256": upload['sha256'],
+        "received": upload['received'],
+        "status": upload['status']
+    }
+
+def extract_completed_upload(path, filename):
+    """Extract a finished upload from disk; runs on the extraction executor.
+
+    The spool lives next to the upload and is always on disk, since it is
+    kept for as long as the session so the same content can be re-analyzed.
+    """
+    return spool_upload(path, filename, os.path.dirname(path))
+
+def extract_admitted(upload, cost):
+    """Extract a completed upload, holding OCR budget while a scanned PDF is processed"""
+    if cost.work_class != "ocr":
+        return extract_completed_upload(upload['path'], upload['filename'])
+    with admission.admit(upload['session_id'], cost):
+        return extract_completed_upload(upload['path'], upload['filename'])
+
+def start_extraction(upload):
+    """Extract a verified upload in the background, through admission if it needs OCR.
+
+    The upload only becomes complete together with its extraction, so every
+    complete upload has one to wait for.
+    """
+    cost = estimate_cost([(upload['path'], upload['filename'])])
+    extraction = extraction_executor.submit(extract_admitted, upload, cost)
+    with uploads_lock:
+        upload['extraction'] = extraction
+        upload['status'] = "complete"
+
+def verify_upload(upload):
+    """Check a fully received upload against its declared hash"""
+    if file_sha256(upload['path']) != upload['sha256']:
+        # Corrupt transfer: start over from zero on the next PUT
+        open(upload['path'], 'wb').close()
+        with uploads_lock:
+            upload['received'] = 0
+        abort(422, "Checksum mismatch, upload restarted")
+
+def register_upload(session_id, filename, size, sha256):
+    """Validate and record a new chunked upload; returns (upload, created)"""
+    get_active_config(session_id)
+    filename = secure_filename(filename or '')
+    sha256 = (sha256 or '').lower()
+    
+    if not filename or not (allowed_document_file(filename) or is_zip_file(filename)):
+        abort(400, "Invalid document file type")
+    if not isinstance(size, int) or size <= 0 or size > MAX_DOCUMENT_SIZE:
+        abort(400, f"File size must be between 1 byte and {MAX_DOCUMENT_SIZE//1024//1024}MB")
+    if len(sha256) != 64:
+        abort(400, "SHA-256 content hash required")
+    
+    with uploads_lock:
+        session = sessions.get(session_id)
+        if session is None:
+            abort(400, "Invalid or expired session ID")
         
-        sessions[session_id] = {
-            "config": config,
-            "expiry": expiry
-        }
+        # Same content already uploaded (or partially uploaded): reuse it
+        existing = session['upload_hashes'].get(sha256)
+        if existing:
+            return session['uploads'][existing], False
+        
+        upload_id = str(uuid.uuid4())
+        upload_dir = os.path.join(UPLOAD_ROOT, session_id)
+        os.makedirs(upload_dir, exist_ok=True)
         
-        return jsonify({
-            "status": "success",
+        upload = {
+            "upload_id": upload_id,
             "session_id": session_id,
-            "expires_at": expiry.isoformat()
-        })
-    except ValueError as e:
-        abort(400, str(e))
+            "filename": filename,
+            "size": size,
+            "sha256": sha256,
+            "path": os.path.join(upload_dir, upload_id),
+            "received": 0,
+            "status": "uploading",
+            "extraction": None
+        }
+        open(upload['path'], 'wb').close()
+        session['uploads'][upload_id] = upload
+        session['upload_hashes'][sha256] = upload_id
+    
+    return upload, True
 
-@app.route('/upload_documents', methods=['POST'])
-def upload_documents():
-    """Second step: Upload documents and process with config"""
-    # Validate session
-    if 'session_id' not in request.form:
-        abort(400, "Session ID required")
+def get_upload(upload_id):
+    """Find a chunked upload and its session, aborting if it is unknown or expired"""
+    with uploads_lock:
+        upload = next((data['uploads'][upload_id] for data in sessions.values()
+                       if upload_id in data.get('uploads', {})), None)
+    if not upload:
+        abort(404, "Upload not found")
+    get_active_config(upload['session_id'])
+    return upload
+
+def parse_chunk_offset(value):
+    try:
+        return int(value or '')
+    except ValueError:
+        abort(400, "Chunk offset required")
+
+def begin_chunk(upload, offset, length):
+    """Claim an upload for one chunk; returns an early (status, code) reply or None"""
+    if not length or length > MAX_UPLOAD_CHUNK:
+        abort(413, f"Chunks must be between 1 byte and {MAX_UPLOAD_CHUNK//1024//1024}MB")
     
-    session_id = request.form['session_id']
-    if session_id not in sessions or datetime.now() > sessions[session_id]['expiry']:
-        abort(400, "Invalid or expired session ID")
+    with uploads_lock:
+        if upload['status'] == "complete":
+            return upload_status(upload), 200
+        # Client is out of sync (e.g. a retried chunk); tell it where to resume
+        if upload['status'] == "receiving" or offset != upload['received']:
+            return upload_status(upload), 409
+        if offset + length > upload['size']:
+            abort(400, "Chunk exceeds declared file size")
+        upload['status'] = "receiving"
+    return None
+
+def release_chunk(upload, received):
+    """Record how far a chunk got and let the next one in"""
+    with uploads_lock:
+        upload['received'] = received
+        upload['status'] = "uploading"
+
+def complete_chunk(upload, written, length):
+    """Check a stored chunk; verify the upload once its last byte arrived.
+
+    Returns True when the upload was just fully received and verified, and
+    its extraction should start.
+    """
+    if written != length:
+        abort(400, "Chunk body shorter than Content-Length")
+    if upload['received'] != upload['size']:
+        return False
+    verify_upload(upload)
+    return True
+
+def get_completed_uploads(session_id, upload_ids):
+    """Look up chunked uploads by ID, aborting unless all of them are complete"""
+    uploads = sessions[session_id]['uploads']
+    completed = []
+    
+    for upload_id in upload_ids:
+        upload = uploads.get(upload_id)
+        if not upload:
+            abort(400, f"Unknown upload {upload_id}")
+        if upload['status'] != "complete" or upload['extraction'] is None:
+            abort(409, f"Upload {upload['filename']} is incomplete")
+        completed.append(upload)
+    
+    return completed
+
+def collect_uploaded_text(uploads):
+    """Wait for the extraction of completed chunked uploads and merge their text"""
+    parts = []
     
-    config = sessions[session_id]['config']
+    for upload in uploads:
+        try:
+            parts.append(upload['extraction'].result())
+        except ArchiveError as e:
+            abort(400, str(e))
+        except TooManyRequests:
+            # OCR capacity was saturated: queue the extraction again for the client's retry
+            start_extraction(upload)
+            raise
     
+    return copy_spools(parts)
+
+def copy_spools(parts):
+    """Concatenate spools into a new one, leaving the parts intact for re-analysis"""
+    spool = TextSpool()
+    try:
+        for part in parts:
+            spool.extend(part)
+    except BaseException:
+        spool.close()
+        raise
+    return spool.finalize()
+
+def iter_multipart_documents(files):
+    """Yield documents sent as a plain multipart upload, one at a time"""
     # Validate documents
-    if 'document_files' not in request.files:
+    if 'document_files' not in files:
         abort(400, "No documents uploaded")
     
-    document_files = request.files.getlist('document_files')
+    document_files = files.getlist('document_files')
     if not document_files or all(f.filename == '' for f in document_files):
         abort(400, "No selected files")
     
-    # Process documents
-    documents = []
-    temp_dir = tempfile.mkdtemp()
+    # Process documents straight from the upload streams, no temp copies
+    for file in document_files:
+        if not file or not file.filename:
+            continue
+        if not allowed_document_file(file.filename) and not is_zip_file(file.filename):
+            continue
+            
+        try:
+            yield from iter_upload(file.stream, secure_filename(file.filename))
+        except ArchiveError as e:
+            abort(400, str(e))
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """Start (or resume) a chunked upload for one document"""
+    body = request.get_json(silent=True) or {}
+    if not body.get('session_id'):
+        abort(400, "Session ID required")
     
-    try:
-        for file in document_files:
-            if not file or not file.filename or not allowed_document_file(file.filename):
-                continue
-                
-            try:
-                filename = secure_filename(file.filename)
-                filepath = os.path.join(temp_dir, filename)
-                file.save(filepath)
-                
-                # Process based on file type
-                if filename.lower().endswith('.pdf'):
-                    try:
-                        loader = PyPDFLoader(filepath)
-                        docs = loader.load()
-                        if sum(len(d.page_content) for d in docs) < MIN_TEXT_LENGTH * len(docs):
-                            full_text = extract_text_with_ocr(filepath)
-                            if full_text.strip():
-                                docs = [Document(page_content=full_text)]
-                    except Exception as e:
-                        full_text = extract_text_with_ocr(filepath)
-                        docs = [Document(page_content=full_text)] if full_text.strip() else []
-                        
-                    documents.extend(docs)
-                    
-                elif filename.lower().endswith('.docx'):
-                    loader = Docx2txtLoader(filepath)
-                    documents.extend(loader.load())
-                elif filename.lower().endswith('.txt'):
-                    loader = TextLoader(filepath)
-                    documents.extend(loader.load())
-                elif filename.lower().endswith('.csv'):
-                        df = pd.read_csv(filepath)
-                        content = df.to_markdown(index=False)
-                        print("Extracted CSV content:\n", content[:300])
-                        docs = [Document(page_content=content, metadata={"source": filename})]
-
-                elif filename.lower().endswith('.xlsx'):
-                    df = pd.read_excel(filepath, engine='openpyxl')
-                    # 🧹 Clean: remove fully empty rows/columns
-                    df.dropna(how='all', inplace=True)
-                    df.dropna(axis=1, how='all', inplace=True)
-
-                    if not df.empty:
-                        try:
-                            content = df.to_markdown(index=False)
-                        except ImportError:
-                            content = df.to_string(index=False)
-
-                        print("Extracted Excel content:\n", content[:300])
-                        docs = [Document(page_content=content)]
-                    else:
-                        print("WARNING: Excel sheet is empty after cleaning.")
-                        docs = []
-
-                    
-            except Exception as e:
-                continue
+    upload, created = register_upload(body['session_id'], body.get('filename'),
+                                      body.get('size'), body.get('sha256'))
+    return jsonify(upload_status(upload)), 201 if created else 200
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """Append one chunk at the given offset to a chunked upload"""
+    upload = get_upload(upload_id)
+    offset = parse_chunk_offset(request.args.get('offset'))
+    length = request.content_length
+    
+    early = begin_chunk(upload, offset, length)
+    if early:
+        return jsonify(early[0]), early[1]
     
+    written = 0
+    try:
+        with open(upload['path'], 'r+b') as f:
+            f.seek(offset)
+            while written < length:
+                block = request.stream.read(min(ZIP_READ_CHUNK, length - written))
+                if not block:
+                    break
+                f.write(block)
+                written += len(block)
+            # Drop anything left over from an interrupted earlier attempt
+            f.truncate(offset + written)
     finally:
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
+        release_chunk(upload, offset + written)
     
-    if not documents:
-        abort(400, "No valid content extracted from documents")
+    if complete_chunk(upload, written, length):
+        start_extraction(upload)
     
-    # Process text
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP
-    )
-    splits = text_splitter.split_documents(documents)
+    return jsonify(upload_status(upload))
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload_status(upload_id):
+    """Report how much of a chunked upload has been received"""
+    return jsonify(upload_status(get_upload(upload_id)))
+
+@app.route('/upload_documents', methods=['POST'])
+def upload_documents():
+    """Second step: Upload documents and process with config"""
+    # Validate session
+    if 'session_id' not in request.form:
+        abort(400, "Session ID required")
     
-    # Filter out noise
-    filtered_splits = []
-    for doc in splits:
-        content = doc.page_content.strip()
-        if (len(content) > 100 and 
-            not content.count('_') > len(content) * 0.3 and
-            not content.count('.') > len(content) * 0.1):
-            filtered_splits.append(doc)
+    session_id = request.form['session_id']
+    config = get_active_config(session_id)
     
-    full_text = "\n\n".join([doc.page_content for doc in filtered_splits])
+    # Documents sent through the chunked upload protocol are already extracted
+    upload_ids = request.form.getlist('upload_ids')
+    if upload_ids:
+        uploads = get_completed_uploads(session_id, upload_ids)
+        cost = estimate_cost([(u['path'], u['filename']) for u in uploads], extracted=True)
+    else:
+        cost = estimate_cost([
+            (f.stream, f.filename) for f in request.files.getlist('document_files')
+            if f.filename and (allowed_document_file(f.filename) or is_zip_file(f.filename))
+        ])
     
-    # Generate and process prompt
-    try:
-        prompt = build_dynamic_prompt(config['fields'], full_text)
-        llm_response = query_openrouter(prompt, session_id)
-        
-        # Extract JSON from response
-        start_idx = llm_response.find('{')
-        end_idx = llm_response.rfind('}') + 1
-        json_result = llm_response[start_idx:end_idx]
+    # Fails fast with 429 + Retry-After when this class of work is saturated
+    with admission.admit(session_id, cost) as ticket:
+        if upload_ids:
+            spool = collect_uploaded_text(uploads)
+        else:
+            spool = build_text_spool(iter_multipart_documents(request.files))
         
-        try:
-            parsed = json.loads(json_result)
-            return jsonify({
-                "status": "success",
-                "data": parsed,
-                "text_sample": full_text[:500] + "..." if len(full_text) > 500 else full_text
-            })
-        except json.JSONDecodeError:
-            return jsonify({
-                "status": "partial_success",
-                "raw_response": llm_response,
-                "message": "Could not parse LLM response as JSON"
-            })
+        with spool:
+            if not spool.document_count:
+                abort(400, "No valid content extracted from documents")
             
-    except Exception as e:
-        abort(500, f"Analysis failed: {str(e)}")
+            batch_id = index_batch(session_id, spool)
+            
+            # Generate and process prompt
+            try:
+                result = run_analysis(config['fields'], spool, session_id, batch_id)
+            except AnalysisError as e:
+                response = jsonify(e.body())
+                response.status_code = 500
+                abort(response)
+            except Exception as e:
+                abort(500, f"Analysis failed: {str(e)}")
+    
+    result["admission"] = admission_report(cost, ticket)
+    return jsonify(result)
+
+@app.route('/results/<result_id>/export/<export_format>', methods=['GET'])
+def export_result(result_id, export_format):
+    """Download a stored result as JSON, text, XML, DOCX, PDF or CSV"""
+    rendered, mime, headers = build_export_response(result_id, export_format)
+    return Response(iter_export(rendered), mimetype=mime, headers=headers)
 
 @app.route('/session/<session_id>', methods=['GET'])
 def get_session(session_id):
@@ -355,14 +1035,35 @@ def get_session(session_id):
         "fields": [f['name'] for f in sessions[session_id]['config']['fields']]
     })
 
+@app.route('/session/<session_id>/search', methods=['GET'])
+def search_session(session_id):
+    """Full-text search over the text extracted in a session"""
+    get_active_config(session_id)
+    query = request.args.get('q', '').strip()
+    if not query:
+        abort(400, "Search query 'q' required")
+    limit = request.args.get('limit', 20, type=int)
+    
+    started = time.perf_counter()
+    results = search_index.search(session_id, query, limit)
+    return jsonify({
+        "query": query,
+        "results": results,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2)
+    })
+
 @app.route('/')
 def home():
     return jsonify({
         "message": "Document Analysis API",
         "endpoints": {
             "/upload_config": "POST - Upload configuration",
-            "/upload_documents": "POST - Upload documents with session_id",
+            "/uploads": "POST - Start or resume a chunked document upload",
+            "/uploads/<id>": "PUT - Upload a chunk at ?offset=, GET - Upload progress",
+            "/upload_documents": "POST - Analyze documents (multipart, ZIP or upload_ids) with session_id",
+            "/results/<id>/export/<format>": "GET - Export a result (json, text, xml, docx, pdf, csv)",
             "/session/<id>": "GET - Check session status",
+            "/session/<id>/search": "GET - Search extracted text (?q=...&limit=)",
             "/health": "GET - Service health"
         }
     })
@@ -372,7 +1073,10 @@ def health_check():
     return jsonify({
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "active_sessions": len(sessions)
+        "active_sessions": len(sessions),
+        "admission": admission.stats(),
+        "models": router.summary(),
+        "memory": memory_usage()
     })
 
 if __name__ == '__main__':
@@ -0,0 +1,463 @@
+import os
+import asyncio
+import tempfile
+import shutil
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from quart import Quart, Response, request, jsonify, abort
+from quart_cors import cors
+from werkzeug.exceptions import TooManyRequests
+from werkzeug.utils import secure_filename
+import httpx  # Async client for OpenRouter API calls
+
+# Reuse the sync service's pipeline so both servers behave identically
+from app import (
+    OPENROUTER_API_URL,
+    OPENROUTER_TIMEOUT,
+    MAX_REQUEST_SIZE,
+    sessions,
+    uploads_lock,
+    AnalysisError,
+    ArchiveError,
+    allowed_document_file,
+    is_zip_file,
+    allowed_config_file,
+    parse_config_content,
+    build_openrouter_request,
+    analysis_steps,
+    spool_upload,
+    get_active_config,
+    create_session,
+    build_export_response,
+    admission_report,
+    router,
+    index_batch,
+    upload_status,
+    register_upload,
+    get_upload,
+    parse_chunk_offset,
+    begin_chunk,
+    release_chunk,
+    complete_chunk,
+    extract_completed_upload,
+    get_completed_uploads,
+    copy_spools,
+)
+import search_index
+from admission import OCR_BUDGET, AdmissionController, estimate_cost
+from exports import iter_export
+from text_spool import TextSpool, merge_spools, memory_usage
+
+app = Quart(__name__)
+app = cors(app, allow_origin=["http://localhost:8501", "http://127.0.0.1:8501"],
+           allow_methods=["GET", "POST", "OPTIONS"],
+           allow_headers=["Content-Type", "Authorization"])
+
+# Configuration
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", os.cpu_count() or 2))
+OPENROUTER_MAX_CONNECTIONS = int(os.getenv("OPENROUTER_MAX_CONNECTIONS", 500))
+# LLM-bound work here is mostly awaiting OpenRouter, so this server admits far
+# more of it than the sync one (LLM_BUDGET); keep it under the connection pool
+ASYNC_LLM_BUDGET = int(os.getenv("ASYNC_LLM_BUDGET", 256))
+BODY_TIMEOUT = int(os.getenv("BODY_TIMEOUT", 600))  # seconds to receive a request body
+
+# Quart caps bodies at 16MB and 60s by default; allow what the sync server accepts
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_SIZE
+app.config['BODY_TIMEOUT'] = BODY_TIMEOUT
+
+admission = AdmissionController({"ocr": OCR_BUDGET, "llm": ASYNC_LLM_BUDGET})
+
+# Shared across requests, created once the event loop is running
+http_client = None
+extraction_pool = None
+
+@app.before_serving
+async def startup():
+    global http_client, extraction_pool
+    http_client = httpx.AsyncClient(
+        timeout=OPENROUTER_TIMEOUT,
+        limits=httpx.Limits(max_connections=OPENROUTER_MAX_CONNECTIONS,
+                            max_keepalive_connections=OPENROUTER_MAX_CONNECTIONS)
+    )
+    # Extraction, OCR and splitting are CPU-bound; keep them off the event loop
+    # and out of the serving process's GIL. The serving process already runs
+    # threads (event loop, executors, httpx), so workers must not be forked from it.
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    extraction_pool = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS,
+                                          mp_context=multiprocessing.get_context(start_method))
+
+@app.after_serving
+async def shutdown():
+    await http_client.aclose()
+    extraction_pool.shutdown(wait=False, cancel_futures=True)
+
+def extraction_worker_pids():
+    """PIDs of the extraction pool's worker processes"""
+    # ProcessPoolExecutor has no public accessor for its workers
+    return list(getattr(extraction_pool, '_processes', None) or ())
+
+async def run_cpu_bound(func, *args):
+    """Run a CPU-bound function in the extraction pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(extraction_pool, func, *args)
+
+async def query_openrouter(prompt, session_id=None, schema=None, model=None, timeout=None):
+    """Call OpenRouter API with the given prompt without blocking the event loop"""
+    headers, payload = build_openrouter_request(prompt, schema, model)
+
+    try:
+        response = await http_client.post(OPENROUTER_API_URL, headers=headers, json=payload,
+                                          timeout=timeout or OPENROUTER_TIMEOUT)
+        response.raise_for_status()
+        return response.json()['choices'][0]['message']['content']
+    except Exception as e:
+        raise ValueError(f"OpenRouter API error: {str(e)}")
+
+async def query_with_plan(prompt, schema, plan, session_id=None):
+    """Call OpenRouter following a route plan, falling back to the next model on failure"""
+    error = None
+    for model in plan.models:
+        started = time.monotonic()
+        try:
+            reply = await query_openrouter(prompt, session_id, schema if plan.structured_output else None,
+                                           model, plan.timeout)
+        except ValueError as e:
+            plan.record(model, time.monotonic() - started, e)
+            error = e
+            continue
+        plan.record(model, time.monotonic() - started)
+        return reply
+    raise error
+
+def advance_steps(steps, reply):
+    """Resume the analysis steps; returns (next request, None) or (None, result).
+
+    StopIteration cannot be passed through an executor future, so the
+    generator's result is returned instead.
+    """
+    try:
+        return steps.send(reply), None
+    except StopIteration as done:
+        return None, done.value
+
+async def run_analysis(fields, spool, session_id=None, batch_id=None):
+    """Run the shared analysis steps against OpenRouter asynchronously.
+
+    Between LLM calls the steps scan the whole spool (local extraction,
+    prompt text selection, reply repair), so they run in the default
+    executor; only the OpenRouter calls are awaited on the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    steps = analysis_steps(fields, spool, batch_id)
+    llm_request, result = await loop.run_in_executor(None, advance_steps, steps, None)
+    first = True
+
+    while llm_request:
+        prompt, schema, plan = llm_request
+        try:
+            reply = await query_with_plan(prompt, schema, plan, session_id)
+        except ValueError as e:
+            # The first request must succeed (the steps turn its failure into
+            # an AnalysisError); follow-ups are best effort
+            if first:
+                steps.throw(e)
+            reply = None
+        first = False
+        llm_request, result = await loop.run_in_executor(None, advance_steps, steps, reply)
+
+    return result
+
+async def extract_file(filepath, filename):
+    """Extract one saved upload into a spool next to it, treating failures as empty"""
+    try:
+        return await run_cpu_bound(spool_upload, filepath, filename, os.path.dirname(filepath))
+    except ArchiveError:
+        raise
+    except Exception as e:
+        return TextSpool()
+
+async def extract_admitted(upload, cost):
+    """Extract a completed upload, holding OCR budget while a scanned PDF is processed"""
+    if cost.work_class != "ocr":
+        return await run_cpu_bound(extract_completed_upload, upload['path'], upload['filename'])
+    async with admission.admit_async(upload['session_id'], cost):
+        return await run_cpu_bound(extract_completed_upload, upload['path'], upload['filename'])
+
+async def start_extraction(upload):
+    """Extract a verified upload in the background, through admission if it needs OCR.
+
+    The upload only becomes complete together with its extraction.
+    """
+    loop = asyncio.get_running_loop()
+    cost = await loop.run_in_executor(None, estimate_cost, [(upload['path'], upload['filename'])])
+    extraction = asyncio.ensure_future(extract_admitted(upload, cost))
+    with uploads_lock:
+        upload['extraction'] = extraction
+        upload['status'] = "complete"
+
+async def collect_uploaded_text(uploads):
+    """Wait for the extraction of completed chunked uploads and merge their text"""
+    parts = []
+    for upload in uploads:
+        try:
+            # Shielded: the extraction belongs to the upload, not to this request
+            parts.append(await asyncio.shield(upload['extraction']))
+        except ArchiveError as e:
+            abort(400, str(e))
+        except TooManyRequests:
+            # OCR capacity was saturated: queue the extraction again for the client's retry
+            await start_extraction(upload)
+            raise
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, copy_spools, parts)
+
+async def analyze_spool(session_id, config, spool):
+    """Index a batch's text and run the analysis on it, closing the spool afterwards"""
+    with spool:
+        if not spool.document_count:
+            abort(400, "No valid content extracted from documents")
+
+        loop = asyncio.get_running_loop()
+        batch_id = await loop.run_in_executor(None, index_batch, session_id, spool)
+
+        # Generate and process prompt
+        try:
+            result = await run_analysis(config['fields'], spool, session_id, batch_id)
+        except AnalysisError as e:
+            response = jsonify(e.body())
+            response.status_code = 500
+            abort(response)
+        except Exception as e:
+            abort(500, f"Analysis failed: {str(e)}")
+
+    # Extraction ran in the pool, so report the workers' memory as well
+    result["memory"].update(memory_usage(extraction_worker_pids()))
+    return result
+
+@app.route('/upload_config', methods=['POST'])
+async def upload_config():
+    """First step: Upload configuration file"""
+    files = await request.files
+    if 'config_file' not in files:
+        abort(400, "No config file uploaded")
+
+    config_file = files['config_file']
+    if not config_file.filename or not allowed_config_file(config_file.filename):
+        abort(400, "Invalid config file type")
+
+    try:
+        config = parse_config_content(config_file.read(), config_file.filename)
+    except ValueError as e:
+        abort(400, str(e))
+
+    # Creating a session purges expired ones, including a SQLite write to the
+    # search index that can wait behind an indexing transaction
+    loop = asyncio.get_running_loop()
+    return jsonify(await loop.run_in_executor(None, create_session, config))
+
+@app.route('/upload_documents', methods=['POST'])
+async def upload_documents():
+    """Second step: Upload documents and process with config"""
+    form = await request.form
+    files = await request.files
+
+    # Validate session
+    if 'session_id' not in form:
+        abort(400, "Session ID required")
+
+    session_id = form['session_id']
+    config = get_active_config(session_id)
+    loop = asyncio.get_running_loop()
+
+    # Documents sent through the chunked upload protocol are already extracted
+    upload_ids = form.getlist('upload_ids')
+    if upload_ids:
+        uploads = get_completed_uploads(session_id, upload_ids)
+        cost = await loop.run_in_executor(
+            None, estimate_cost, [(u['path'], u['filename']) for u in uploads], True)
+
+        async with admission.admit_async(session_id, cost) as ticket:
+            spool = await collect_uploaded_text(uploads)
+            result = await analyze_spool(session_id, config, spool)
+
+        result["admission"] = admission_report(cost, ticket)
+        return jsonify(result)
+
+    # Validate documents
+    if 'document_files' not in files:
+        abort(400, "No documents uploaded")
+
+    document_files = files.getlist('document_files')
+    if not document_files or all(f.filename == '' for f in document_files):
+        abort(400, "No selected files")
+
+    # Process documents
+    temp_dir = tempfile.mkdtemp()
+
+    try:
+        saved = []
+        for file in document_files:
+            if not file or not file.filename:
+                continue
+            if not allowed_document_file(file.filename) and not is_zip_file(file.filename):
+                continue
+
+            filename = secure_filename(file.filename)
+            filepath = os.path.join(temp_dir, filename)
+            await file.save(filepath)
+            saved.append((filepath, filename))
+
+        cost = await loop.run_in_executor(None, estimate_cost, saved)
+
+        # Fails fast with 429 + Retry-After when this class of work is saturated
+        async with admission.admit_async(session_id, cost) as ticket:
+            # Extract, split and filter all files in parallel, preserving upload order
+            try:
+                parts = await asyncio.gather(*(extract_file(p, n) for p, n in saved))
+            except ArchiveError as e:
+                abort(400, str(e))
+
+            # Worker spools live in temp_dir, so merge them before it is removed
+            spool = await loop.run_in_executor(None, merge_spools, parts)
+            shutil.rmtree(temp_dir)
+
+            result = await analyze_spool(session_id, config, spool)
+
+    finally:
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+
+    result["admission"] = admission_report(cost, ticket)
+    return jsonify(result)
+
+@app.route('/uploads', methods=['POST'])
+async def create_upload():
+    """Start (or resume) a chunked upload for one document"""
+    body = await request.get_json(silent=True) or {}
+    if not body.get('session_id'):
+        abort(400, "Session ID required")
+
+    loop = asyncio.get_running_loop()
+    upload, created = await loop.run_in_executor(
+        None, register_upload, body['session_id'], body.get('filename'),
+        body.get('size'), body.get('sha256'))
+    return jsonify(upload_status(upload)), 201 if created else 200
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+async def upload_chunk(upload_id):
+    """Append one chunk at the given offset to a chunked upload"""
+    upload = get_upload(upload_id)
+    offset = parse_chunk_offset(request.args.get('offset'))
+    length = request.content_length
+
+    early = begin_chunk(upload, offset, length)
+    if early:
+        return jsonify(early[0]), early[1]
+
+    # File writes and the final checksum go through the default executor
+    loop = asyncio.get_running_loop()
+    written = 0
+    try:
+        f = await loop.run_in_executor(None, open, upload['path'], 'r+b')
+        try:
+            await loop.run_in_executor(None, f.seek, offset)
+            async for block in request.body:
+                block = block[:length - written]
+                await loop.run_in_executor(None, f.write, block)
+                written += len(block)
+                if written >= length:
+                    break
+            # Drop anything left over from an interrupted earlier attempt
+            await loop.run_in_executor(None, f.truncate, offset + written)
+        finally:
+            await loop.run_in_executor(None, f.close)
+    finally:
+        release_chunk(upload, offset + written)
+
+    if await loop.run_in_executor(None, complete_chunk, upload, written, length):
+        await start_extraction(upload)
+
+    return jsonify(upload_status(upload))
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+async def get_upload_status(upload_id):
+    """Report how much of a chunked upload has been received"""
+    return jsonify(upload_status(get_upload(upload_id)))
+
+@app.route('/results/<result_id>/export/<export_format>', methods=['GET'])
+async def export_result(result_id, export_format):
+    """Download a stored result as JSON, text, XML, DOCX, PDF or CSV"""
+    # DOCX/PDF rendering is CPU-bound; cached artifacts return immediately
+    loop = asyncio.get_running_loop()
+    rendered, mime, headers = await loop.run_in_executor(
+        None, build_export_response, result_id, export_format)
+
+    async def stream():
+        for block in iter_export(rendered):
+            yield block
+
+    return Response(stream(), mimetype=mime, headers=headers)
+
+@app.route('/session/<session_id>', methods=['GET'])
+async def get_session(session_id):
+    """Check session status"""
+    if session_id not in sessions:
+        abort(404, "Session not found")
+
+    return jsonify({
+        "status": "active",
+        "expires_at": sessions[session_id]['expiry'].isoformat(),
+        "fields": [f['name'] for f in sessions[session_id]['config']['fields']]
+    })
+
+@app.route('/session/<session_id>/search', methods=['GET'])
+async def search_session(session_id):
+    """Full-text search over the text extracted in a session"""
+    get_active_config(session_id)
+    query = request.args.get('q', '').strip()
+    if not query:
+        abort(400, "Search query 'q' required")
+    limit = request.args.get('limit', 20, type=int)
+
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(None, search_index.search, session_id, query, limit)
+    return jsonify({
+        "query": query,
+        "results": results,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2)
+    })
+
+@app.route('/')
+async def home():
+    return jsonify({
+        "message": "Document Analysis API (async)",
+        "endpoints": {
+            "/upload_config": "POST - Upload configuration",
+            "/uploads": "POST - Start or resume a chunked document upload",
+            "/uploads/<id>": "PUT - Upload a chunk at ?offset=, GET - Upload progress",
+            "/upload_documents": "POST - Analyze documents (multipart, ZIP or upload_ids) with session_id",
+            "/results/<id>/export/<format>": "GET - Export a result (json, text, xml, docx, pdf, csv)",
+            "/session/<id>": "GET - Check session status",
+            "/session/<id>/search": "GET - Search extracted text (?q=...&limit=)",
+            "/health": "GET - Service health"
+        }
+    })
+
+@app.route('/health')
+async def health_check():
+    return jsonify({
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "active_sessions": len(sessions),
+        "admission": admission.stats(),
+        "models": router.summary(),
+        "memory": memory_usage(extraction_worker_pids())
+    })
+
+if __name__ == '__main__':
+    # For production run under an ASGI server, e.g. `hypercorn async_app:app --bind 0.0.0.0:5001`
+    app.run(host='0.0.0.0', port=5001)
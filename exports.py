@@ -0,0 +1,127 @@
+import io
+import csv
+import json
+import hashlib
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from docx import Document as DocxDocument
+from fpdf import FPDF  # fpdf2; the legacy PyFPDF package lacks fpdf.enums
+from fpdf.enums import XPos, YPos
+
+# Configuration
+EXPORT_CACHE_SIZE = 256  # rendered artifacts kept in memory
+EXPORT_STREAM_CHUNK = 256 * 1024  # 256KB per streamed block
+
+# LRU cache of rendered exports keyed by (result hash, format)
+_export_cache = OrderedDict()
+_export_cache_lock = threading.Lock()
+
+def result_hash(data):
+    """Stable content hash of an analysis result"""
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def result_items(data):
+    """The list of extracted fields in a result, tolerating malformed replies"""
+    items = data.get('results', []) if isinstance(data, dict) else []
+    return [item for item in items if isinstance(item, dict)]
+
+def render_json(data):
+    return json.dumps(data, indent=2).encode('utf-8')
+
+def render_text(data):
+    parts = []
+    for i, item in enumerate(result_items(data), 1):
+        parts.append(
+            f"Result {i}:\n"
+            f"Field: {item.get('field', 'N/A')}\n"
+            f"Type: {item.get('type', 'N/A')}\n"
+            f"Confidence: {item.get('confidence', 'N/A')}\n"
+            f"Value: {item.get('value', 'N/A')}\n"
+            + "-" * 50 + "\n\n"
+        )
+    return "".join(parts).encode('utf-8')
+
+def render_xml(data):
+    root = ET.Element("AnalysisResults")
+    for item in result_items(data):
+        result_elem = ET.SubElement(root, "Result")
+        ET.SubElement(result_elem, "Field").text = str(item.get('field', ''))
+        ET.SubElement(result_elem, "Type").text = str(item.get('type', ''))
+        ET.SubElement(result_elem, "Confidence").text = str(item.get('confidence', ''))
+        ET.SubElement(result_elem, "Value").text = str(item.get('value', ''))
+    return ET.tostring(root, encoding='utf-8')
+
+def render_docx(data):
+    output = io.BytesIO()
+    doc = DocxDocument()
+    doc.add_heading("Extracted Data", level=1)
+    for item in result_items(data):
+        doc.add_paragraph(f"{item.get('field', '')}: {item.get('value', '')}")  # Key-value pair
+    doc.save(output)
+    return output.getvalue()
+
+def pdf_safe(value):
+    """Replace what the core PDF fonts cannot encode"""
+    return str(value).encode('latin-1', 'replace').decode('latin-1')
+
+def render_pdf(data):
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("helvetica", size=12)
+
+    for item in result_items(data):
+        # Back to the left margin after each entry, or the next full-width cell has no room
+        pdf.multi_cell(0, 10, f"{pdf_safe(item.get('field', ''))}: {pdf_safe(item.get('value', ''))}",
+                       new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
+    return bytes(pdf.output())
+
+def render_csv(data):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["field", "type", "confidence", "value"])
+    for item in result_items(data):
+        writer.writerow([item.get('field', ''), item.get('type', ''),
+                         item.get('confidence', ''), item.get('value', '')])
+    return output.getvalue().encode('utf-8')
+
+# format -> (renderer, mime type, file extension)
+EXPORT_FORMATS = {
+    "json": (render_json, "application/json", "json"),
+    "text": (render_text, "text/plain", "txt"),
+    "xml": (render_xml, "application/xml", "xml"),
+    "docx": (render_docx, "application/vnd.openxmlformats-officedocument.wordprocessingml.document", "docx"),
+    "pdf": (render_pdf, "application/pdf", "pdf"),
+    "csv": (render_csv, "text/csv", "csv"),
+}
+
+def render_export(data, export_format, data_hash=None):
+    """Render a result in the given format, reusing a cached artifact when possible"""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+
+    key = (data_hash or result_hash(data), export_format)
+    with _export_cache_lock:
+        if key in _export_cache:
+            _export_cache.move_to_end(key)
+            return _export_cache[key]
+
+    # Render outside the lock; a concurrent duplicate render is harmless
+    renderer = EXPORT_FORMATS[export_format][0]
+    rendered = renderer(data)
+
+    with _export_cache_lock:
+        _export_cache[key] = rendered
+        _export_cache.move_to_end(key)
+        while len(_export_cache) > EXPORT_CACHE_SIZE:
+            _export_cache.popitem(last=False)
+
+    return rendered
+
+def iter_export(rendered):
+    """Yield a rendered export in blocks so large downloads stream"""
+    view = memoryview(rendered)
+    for start in range(0, len(view), EXPORT_STREAM_CHUNK):
+        yield bytes(view[start:start + EXPORT_STREAM_CHUNK])
@@ -0,0 +1,515 @@
+"""Load test for the document analysis API.
+
+Starts a local OpenRouter stub with configurable latency and 429 injection
+and, unless --base-url is given, the Flask app pointed at it. Simulated
+users then run the real workflow in ramped stages while /health is polled
+for server RSS: /upload_config, a mixed document batch sent the way the UI
+sends it (chunked /uploads, then /upload_documents with upload_ids) or as
+one multipart /upload_documents request, /session/<id> and
+/session/<id>/search. Results are saved as JSON and can be compared
+against a previous run:
+
+    python loadtest.py --stages 1,5,10,20 --stage-seconds 30 --output baseline.json
+    python loadtest.py --output current.json --compare baseline.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import socket
+import argparse
+import threading
+import subprocess
+from collections import Counter
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+
+# Configuration
+DEFAULT_STAGES = "1,5,10,20"  # concurrent users per stage
+STAGE_SECONDS = 30
+STUB_LATENCY = 1.0  # seconds per stubbed LLM call
+STUB_JITTER = 0.5  # +/- seconds added uniformly to each call
+STUB_429_RATE = 0.05  # share of stubbed LLM calls answered with 429
+THINK_TIME = 0.5  # seconds a user pauses between workflows
+HEALTH_INTERVAL = 1.0  # seconds between /health polls
+REQUEST_TIMEOUT = 300  # matches the UI's analysis timeout
+DRAIN_SECONDS = 60  # wait for requests still in flight after the last stage
+UPLOAD_MODES = ("chunked", "multipart", "mixed")
+UPLOAD_CHUNK_SIZE = 16 * 1024  # small enough that larger synthetic documents take several PUTs
+APP_STARTUP_TIMEOUT = 30
+REGRESSION_TOLERANCE = 0.2  # relative change in p95/throughput reported as a regression
+PERCENTILES = (50, 95, 99)
+
+LOAD_TEST_CONFIG = {
+    "fields": [
+        {"name": "invoice_number", "keywords": ["invoice number", "invoice no"], "response_type": "concise"},
+        {"name": "total_amount", "keywords": ["total amount", "total due"], "response_type": "concise"},
+        {"name": "issue_date", "keywords": ["issue date", "dated"], "response_type": "concise"},
+        {"name": "payment_terms", "keywords": ["payment terms"], "response_type": "detailed"},
+        {"name": "termination_policy", "keywords": ["termination", "cancellation"], "response_type": "detailed"}
+    ]
+}
+
+# Document size mix: (weight, paragraphs)
+DOCUMENT_SIZES = ((6, 5), (3, 50), (1, 400))
+MAX_BATCH_DOCUMENTS = 5
+
+SEARCH_TERMS = ["invoice", "payment terms", "termination notice", "total amount", "purchase order"]
+
+PARAGRAPHS = [
+    "Invoice number INV-{n:06d} was issued to the customer for services rendered.",
+    "Issue date {day:02d}/{month:02d}/2024. Total amount ${amount:,}.{cents:02d} payable on receipt.",
+    "Payment terms: net {terms} days from the invoice date, late payments accrue interest of 1.5% per month.",
+    "Termination of this agreement requires {notice} days written notice by either party.",
+    "The supplier shall deliver the goods to the address stated in the purchase order.",
+    "All prices exclude applicable taxes unless stated otherwise in the schedule.",
+]
+
+# OpenRouter stub
+
+class OpenRouterStub(ThreadingHTTPServer):
+    """Local stand-in for the OpenRouter chat completions API"""
+
+    daemon_threads = True
+
+    def __init__(self, port, latency, jitter, rate_429, seed=None):
+        super().__init__(("127.0.0.1", port), StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.rejected = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/api/v1/chat/completions"
+
+    def stats(self):
+        with self.lock:
+            return {"calls": self.calls, "injected_429": self.rejected,
+                    "latency_seconds": self.latency, "jitter_seconds": self.jitter,
+                    "rate_429": self.rate_429}
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        stub = self.server
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+
+        with stub.lock:
+            stub.calls += 1
+            reject = stub.rng.random() < stub.rate_429
+            delay = max(0.0, stub.latency + stub.rng.uniform(-stub.jitter, stub.jitter))
+            if reject:
+                stub.rejected += 1
+
+        if reject:
+            self.send_json(429, {"error": {"message": "Rate limit exceeded (stub)"}}, {"Retry-After": "1"})
+            return
+
+        time.sleep(delay)
+        results = [
+            {"field": name, "value": f"stub value for {name}", "type": "concise", "confidence": 0.9}
+            for name in requested_fields(payload)
+        ]
+        self.send_json(200, {
+            "model": payload.get('model'),
+            "choices": [{"message": {"role": "assistant", "content": json.dumps({"results": results})}}]
+        })
+
+def requested_fields(payload):
+    """Field names asked for, from the response schema or else the prompt"""
+    try:
+        schema = payload['response_format']['json_schema']['schema']
+        return schema['properties']['results']['items']['properties']['field']['enum']
+    except (KeyError, TypeError):
+        pass
+    prompt = payload.get('messages', [{}])[-1].get('content', '')
+    return [line[2:].split(': Keywords:')[0] for line in prompt.splitlines()
+            if line.startswith('- ') and ': Keywords:' in line]
+
+# Traffic
+
+def make_document(rng, index):
+    """A synthetic (filename, bytes, mimetype) document from the size mix"""
+    weights, sizes = zip(*DOCUMENT_SIZES)
+    paragraphs = rng.choices(sizes, weights)[0]
+    values = {"n": rng.randint(1, 999999), "day": rng.randint(1, 28), "month": rng.randint(1, 12),
+              "amount": rng.randint(100, 99999), "cents": rng.randint(0, 99),
+              "terms": rng.choice((15, 30, 60)), "notice": rng.choice((30, 60, 90))}
+
+    if rng.random() < 0.3:
+        rows = ["invoice_number,issue_date,total_amount"] + [
+            f"INV-{rng.randint(1, 999999):06d},2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d},"
+            f"{rng.randint(100, 99999)}.{rng.randint(0, 99):02d}"
+            for _ in range(paragraphs * 2)
+        ]
+        return f"ledger_{index}.csv", "\n".join(rows).encode('utf-8'), "text/csv"
+
+    text = "\n\n".join(rng.choice(PARAGRAPHS).format(**values) for _ in range(paragraphs))
+    return f"contract_{index}.txt", text.encode('utf-8'), "text/plain"
+
+def load_document_dir(path):
+    """Real documents to mix into batches, read once up front"""
+    documents = []
+    for name in sorted(os.listdir(path)):
+        full_path = os.path.join(path, name)
+        if os.path.isfile(full_path):
+            with open(full_path, 'rb') as f:
+                documents.append((name, f.read(), "application/octet-stream"))
+    return documents
+
+def make_batch(rng, real_documents):
+    batch = []
+    for i in range(rng.randint(1, MAX_BATCH_DOCUMENTS)):
+        if real_documents and rng.random() < 0.5:
+            batch.append(rng.choice(real_documents))
+        else:
+            batch.append(make_document(rng, i))
+    return batch
+
+class Recorder:
+    """Thread-safe log of request outcomes, tagged with the stage they started in"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stage = 0
+        self.samples = []  # (stage, endpoint, latency seconds, status or None, error)
+        self.health = []  # (stage, memory dict)
+
+    def record(self, stage, endpoint, latency, status, error=None):
+        with self.lock:
+            self.samples.append((stage, endpoint, latency, status, error))
+
+    def record_health(self, memory):
+        with self.lock:
+            self.health.append((self.stage, memory))
+
+    def timed(self, session, endpoint, method, url, **kwargs):
+        """Send one request and record it; returns the response or None"""
+        # A slow request belongs to the load level that issued it, not the one it ends in
+        stage = self.stage
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+        except requests.RequestException as e:
+            self.record(stage, endpoint, time.perf_counter() - started, None, type(e).__name__)
+            return None
+        self.record(stage, endpoint, time.perf_counter() - started, response.status_code,
+                    None if response.ok else response.text[:200])
+        return response
+
+def upload_chunked(http, recorder, base_url, session_id, document, chunk_size, stop):
+    """Send one document through the chunked upload protocol; returns its upload ID or None"""
+    filename, data, _ = document
+    response = recorder.timed(http, "uploads_create", "POST", f"{base_url}/uploads", json={
+        "session_id": session_id,
+        "filename": filename,
+        "size": len(data),
+        "sha256": hashlib.sha256(data).hexdigest()
+    })
+    if response is None or not response.ok:
+        return None
+    upload = response.json()
+
+    # Deduplicated content comes back already complete
+    while upload["status"] != "complete":
+        if stop.is_set():
+            return None
+        offset = upload["received"]
+        response = recorder.timed(http, "uploads_put", "PUT", f"{base_url}/uploads/{upload['upload_id']}",
+                                  params={"offset": offset}, data=data[offset:offset + chunk_size],
+                                  headers={"Content-Type": "application/octet-stream"})
+        if response is None or response.status_code not in (200, 409):
+            return None
+        upload = response.json()
+        if response.status_code == 409 and upload["status"] == "receiving":
+            stop.wait(0.25)  # another PUT still holds the upload, as the UI backs off
+    return upload["upload_id"]
+
+def analyze_batch(http, recorder, base_url, session_id, batch, mode, chunk_size, stop):
+    """Upload a batch and analyze it; returns the /upload_documents response or None"""
+    if mode == "multipart":
+        files = [("document_files", document) for document in batch]
+        return recorder.timed(http, "upload_documents", "POST", f"{base_url}/upload_documents",
+                              data={"session_id": session_id}, files=files)
+
+    upload_ids = []
+    for document in batch:
+        upload_id = upload_chunked(http, recorder, base_url, session_id, document, chunk_size, stop)
+        if upload_id is None:
+            return None
+        upload_ids.append(upload_id)
+    return recorder.timed(http, "upload_documents_ids", "POST", f"{base_url}/upload_documents",
+                          data={"session_id": session_id, "upload_ids": upload_ids})
+
+def run_user(base_url, recorder, stop, seed, real_documents, upload_mode="chunked",
+             chunk_size=UPLOAD_CHUNK_SIZE):
+    """One simulated user running the upload workflow until stopped"""
+    rng = random.Random(seed)
+    http = requests.Session()
+    session_id = None
+
+    while not stop.is_set():
+        if session_id is None:
+            response = recorder.timed(http, "upload_config", "POST", f"{base_url}/upload_config", files={
+                "config_file": ("config.json", json.dumps(LOAD_TEST_CONFIG), "application/json")
+            })
+            if response is None or not response.ok:
+                stop.wait(THINK_TIME)
+                continue
+            session_id = response.json()['session_id']
+
+        mode = rng.choice(("chunked", "multipart")) if upload_mode == "mixed" else upload_mode
+        response = analyze_batch(http, recorder, base_url, session_id, make_batch(rng, real_documents),
+                                 mode, chunk_size, stop)
+        if response is not None and response.status_code == 429:
+            # Honour the admission controller's hint, capped so the stage still ends
+            stop.wait(min(float(response.headers.get('Retry-After', 1)), 10))
+        elif response is not None and response.ok:
+            recorder.timed(http, "search", "GET", f"{base_url}/session/{session_id}/search",
+                           params={"q": rng.choice(SEARCH_TERMS)})
+
+        response = recorder.timed(http, "session", "GET", f"{base_url}/session/{session_id}")
+        if response is not None and response.status_code == 404:
+            session_id = None  # expired; start over with a new config
+
+        stop.wait(rng.uniform(0, 2 * THINK_TIME))
+
+def poll_health(base_url, recorder, stop):
+    http = requests.Session()
+    while not stop.is_set():
+        response = recorder.timed(http, "health", "GET", f"{base_url}/health")
+        if response is not None and response.ok:
+            recorder.record_health(response.json().get('memory') or {})
+        stop.wait(HEALTH_INTERVAL)
+
+# Reporting
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(pct / 100 * len(values))) - 1))]
+
+def summarize_stage(recorder, stage, users, duration):
+    samples = [s for s in recorder.samples if s[0] == stage]
+    endpoints = {}
+    for endpoint in sorted({s[1] for s in samples}):
+        rows = [s for s in samples if s[1] == endpoint]
+        latencies = sorted(latency for _, _, latency, status, _ in rows if status and status < 400)
+        errors = [s for s in rows if s[3] is None or s[3] >= 400]
+        statuses = Counter(str(status or "exception") for _, _, _, status, _ in rows)
+        endpoints[endpoint] = {
+            "requests": len(rows),
+            "throughput_rps": round(len(rows) / duration, 3),
+            "error_rate": round(len(errors) / len(rows), 4),
+            "rate_limited": sum(1 for s in rows if s[3] == 429),
+            "statuses": dict(statuses),
+            **{f"p{pct}_ms": round(percentile(latencies, pct) * 1000, 1) if latencies else None
+               for pct in PERCENTILES},
+            "sample_errors": sorted({str(s[4]) for s in errors if s[4]})[:3]
+        }
+
+    memory = [m for s, m in recorder.health if s == stage]
+    rss = [m['rss_mb'] for m in memory if m.get('rss_mb') is not None]
+    workers = [m['workers_rss_mb'] for m in memory if m.get('workers_rss_mb') is not None]
+    return {
+        "users": users,
+        "duration_seconds": round(duration, 1),
+        "requests": len(samples),
+        "throughput_rps": round(len(samples) / duration, 3),
+        "error_rate": round(sum(1 for s in samples if s[3] is None or s[3] >= 400) / len(samples), 4)
+                      if samples else 0.0,
+        "endpoints": endpoints,
+        "server_memory": {
+            "rss_mb_max": max(rss) if rss else None,
+            "rss_mb_last": rss[-1] if rss else None,
+            "workers_rss_mb_max": max(workers) if workers else None,
+            "process_peak_rss_mb": memory[-1].get('process_peak_rss_mb') if memory else None
+        }
+    }
+
+def print_stage(stage):
+    memory = stage['server_memory']
+    print(f"\n{stage['users']} users, {stage['duration_seconds']}s: {stage['throughput_rps']} req/s, "
+          f"{stage['error_rate']:.1%} errors, server RSS max {memory['rss_mb_max']} MB "
+          f"(process peak {memory['process_peak_rss_mb']} MB)")
+    print(f"  {'endpoint':<22}{'reqs':>7}{'req/s':>9}{'err':>8}{'429':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, e in stage['endpoints'].items():
+        print(f"  {name:<22}{e['requests']:>7}{e['throughput_rps']:>9}{e['error_rate']:>8.1%}"
+              f"{e['rate_limited']:>6}{str(e['p50_ms']):>10}{str(e['p95_ms']):>10}{str(e['p99_ms']):>10}")
+
+def compare_results(current, baseline, tolerance=REGRESSION_TOLERANCE):
+    """Regressions of current against baseline, matching stages by user count"""
+    regressions = []
+    baseline_stages = {stage['users']: stage for stage in baseline.get('stages', [])}
+
+    for stage in current['stages']:
+        base = baseline_stages.get(stage['users'])
+        if not base:
+            continue
+        for name, e in stage['endpoints'].items():
+            b = base['endpoints'].get(name)
+            if not b:
+                continue
+            where = f"{stage['users']} users, {name}"
+            if e['p95_ms'] and b['p95_ms'] and e['p95_ms'] > b['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{where}: p95 {b['p95_ms']} -> {e['p95_ms']} ms")
+            if e['throughput_rps'] < b['throughput_rps'] * (1 - tolerance):
+                regressions.append(f"{where}: throughput {b['throughput_rps']} -> {e['throughput_rps']} req/s")
+            if e['error_rate'] > b['error_rate'] + 0.01:
+                regressions.append(f"{where}: error rate {b['error_rate']:.1%} -> {e['error_rate']:.1%}")
+
+        rss, base_rss = stage['server_memory']['rss_mb_max'], base['server_memory']['rss_mb_max']
+        if rss and base_rss and rss > base_rss * (1 + tolerance):
+            regressions.append(f"{stage['users']} users: server RSS {base_rss} -> {rss} MB")
+    return regressions
+
+# Runner
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_app(stub_url, port):
+    """Run the Flask app in a subprocess pointed at the stub"""
+    env = dict(os.environ, OPENROUTER_API_URL=stub_url,
+               OPENROUTER_API_KEY=os.getenv("OPENROUTER_API_KEY", "loadtest"))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port), "--with-threads"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + APP_STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"App exited during startup with code {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/health", timeout=2).ok:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"App did not become healthy within {APP_STARTUP_TIMEOUT}s")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay multi-user traffic against the analysis API")
+    parser.add_argument("--stages", default=DEFAULT_STAGES,
+                        help="comma separated concurrent users per stage; users are added, not restarted")
+    parser.add_argument("--stage-seconds", type=float, default=STAGE_SECONDS)
+    parser.add_argument("--base-url", help="test an already running app instead of starting one "
+                                           "(its OPENROUTER_API_URL must point at the stub)")
+    parser.add_argument("--app-port", type=int, default=0, help="port for the started app (default: any free)")
+    parser.add_argument("--stub-port", type=int, default=0, help="port for the OpenRouter stub (default: any free)")
+    parser.add_argument("--stub-latency", type=float, default=STUB_LATENCY)
+    parser.add_argument("--stub-jitter", type=float, default=STUB_JITTER)
+    parser.add_argument("--stub-429-rate", type=float, default=STUB_429_RATE)
+    parser.add_argument("--documents-dir", help="real documents mixed into the synthetic batches")
+    parser.add_argument("--upload-mode", choices=UPLOAD_MODES, default="chunked",
+                        help="chunked /uploads like the UI, one multipart request, or a random mix")
+    parser.add_argument("--chunk-size", type=int, default=UPLOAD_CHUNK_SIZE, help="bytes per chunked PUT")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=f"loadtest_{datetime.now():%Y%m%d_%H%M%S}.json")
+    parser.add_argument("--compare", help="earlier results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    stages = [int(users) for users in args.stages.split(',') if users.strip()]
+    real_documents = load_document_dir(args.documents_dir) if args.documents_dir else []
+
+    stub = OpenRouterStub(args.stub_port, args.stub_latency, args.stub_jitter, args.stub_429_rate, args.seed)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    print(f"OpenRouter stub at {stub.url}")
+
+    process = None
+    base_url = args.base_url
+    if not base_url:
+        process, base_url = start_app(stub.url, args.app_port or free_port())
+    print(f"Testing {base_url}")
+
+    recorder = Recorder()
+    stop = threading.Event()
+    threads = [threading.Thread(target=poll_health, args=(base_url, recorder, stop), daemon=True)]
+    threads[0].start()
+    started_at = datetime.now().isoformat()
+    completed = []  # (stage, users, duration)
+
+    try:
+        for stage, users in enumerate(stages):
+            recorder.stage = stage
+            while len(threads) - 1 < users:
+                thread = threading.Thread(target=run_user, daemon=True, args=(
+                    base_url, recorder, stop, args.seed * 10000 + len(threads), real_documents,
+                    args.upload_mode, args.chunk_size))
+                thread.start()
+                threads.append(thread)
+
+            print(f"Stage {stage + 1}/{len(stages)}: {users} users for {args.stage_seconds}s")
+            stage_started = time.monotonic()
+            time.sleep(args.stage_seconds)
+            completed.append((stage, users, time.monotonic() - stage_started))
+    except KeyboardInterrupt:
+        print("\nInterrupted, saving completed stages")
+    finally:
+        stop.set()
+        # Requests are summarized by the stage they started in, so let them finish
+        drain_deadline = time.monotonic() + DRAIN_SECONDS
+        for thread in threads:
+            thread.join(timeout=max(0, drain_deadline - time.monotonic()))
+        stub.shutdown()
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+
+    summaries = [summarize_stage(recorder, stage, users, duration) for stage, users, duration in completed]
+    for summary in summaries:
+        print_stage(summary)
+
+    results = {
+        "started_at": started_at,
+        "base_url": base_url,
+        "settings": {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        "stub": stub.stats(),
+        "stages": summaries
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare_results(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\nRegressions against {args.compare}:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print(f"\nNo regressions against {args.compare}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
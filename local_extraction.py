@@ -0,0 +1,154 @@
+import re
+from collections import Counter
+
+from structured_output import field_name
+
+# Configuration
+LOCAL_CONFIDENCE_THRESHOLD = 0.85  # below this a field goes to the LLM
+SINGLE_MENTION_CONFIDENCE = 0.6  # one mention and a built-in pattern: left to the LLM
+VALUE_WINDOW = 60  # characters after a keyword searched for its value
+SEPARATOR = r'[\s:#=\-–.]{0,10}'
+
+# Built-in value patterns, picked by `value_type` or inferred from the field
+VALUE_PATTERNS = {
+    "date": r'\d{4}-\d{2}-\d{2}|\d{1,2}[/.\-]\d{1,2}[/.\-]\d{2,4}'
+            r'|\d{1,2}\s+[A-Za-z]{3,9}\.?\s+\d{4}|[A-Za-z]{3,9}\.?\s+\d{1,2},?\s+\d{4}',
+    "amount": r'(?:[$€£¥]|[A-Z]{3})?\s?-?\d+(?:[,\s]\d{3})*(?:\.\d{1,2})?(?!\d)(?:\s?(?:[$€£¥]|[A-Z]{3}))?',
+    "id": r'[A-Za-z0-9][A-Za-z0-9\-/_.]*\d[A-Za-z0-9\-/_]*',
+}
+
+# Words in a field's name/keywords that imply a value type
+TYPE_HINTS = {
+    "date": ("date", "dated", "issued", "expiry", "expiration"),
+    "amount": ("amount", "total", "price", "cost", "balance", "subtotal", "tax", "fee", "sum"),
+    "id": ("number", "no", "id", "ref", "reference", "code", "#"),
+}
+
+def infer_value_type(field):
+    """Guess the value type of a concise field from its name and keywords"""
+    if field.get('value_type') in VALUE_PATTERNS:
+        return field['value_type']
+
+    words = set()
+    for text in [field.get('name', '')] + list(field.get('keywords', [])):
+        words.update(re.findall(r'[a-z]+|#', str(text).lower()))
+
+    scores = Counter({value_type: len(words & set(hints)) for value_type, hints in TYPE_HINTS.items()})
+    ranked = scores.most_common(2)
+    # No hint, or a tie between types: too ambiguous to resolve locally
+    if not ranked[0][1] or ranked[0][1] == ranked[1][1]:
+        return None
+    return ranked[0][0]
+
+def value_regex(field):
+    """Compiled value pattern for a field, or None if it cannot be resolved locally"""
+    if field.get('pattern'):
+        return re.compile(field['pattern'])
+    if field.get('response_type', 'auto') not in ('concise', 'auto'):
+        return None
+    value_type = infer_value_type(field)
+    return re.compile(VALUE_PATTERNS[value_type]) if value_type else None
+
+def build_keyword_matcher(fields):
+    """One case-insensitive alternation over every keyword of every local field.
+
+    keyword_fields is keyed by casefolded keyword; look hits up with casefold()
+    too, since IGNORECASE also matches forms lower() does not map back (ſ, K).
+    """
+    keywords = set()
+    keyword_fields = {}
+    value_patterns = {}
+
+    for i, field in enumerate(fields):
+        if field.get('response_type') == 'detailed':
+            continue
+        try:
+            pattern = value_regex(field)
+        except re.error:
+            continue
+        if not pattern:
+            continue
+        value_patterns[i] = pattern
+        for keyword in field.get('keywords', []):
+            keyword = str(keyword).strip().lower()
+            if keyword:
+                keywords.add(keyword)
+                keyword_fields.setdefault(keyword.casefold(), []).append(i)
+
+    if not keyword_fields:
+        return None, keyword_fields, value_patterns
+
+    # Longest first so "invoice number" wins over "invoice"
+    alternation = '|'.join(re.escape(k) for k in sorted(keywords, key=len, reverse=True))
+    matcher = re.compile(rf'(?<!\w)(?:{alternation})(?!\w)', re.IGNORECASE)
+    return matcher, keyword_fields, value_patterns
+
+def overlap_length(previous, text, max_overlap):
+    """Length of the prefix of text that repeats the end of the previous chunk"""
+    if not previous or not max_overlap:
+        return 0
+    tail_start = max(0, len(previous) - max_overlap)
+    probe = text[:min(32, max_overlap)]
+    position = previous.find(probe, tail_start) if probe else -1
+    while position != -1:
+        if text.startswith(previous[position:]):
+            return len(previous) - position
+        position = previous.find(probe, position + 1)
+    return 0
+
+def pre_extract(fields, texts, max_overlap=0):
+    """Resolve concise fields locally in a single pass over the text.
+
+    texts is a string or an iterable of chunks, so spooled text can be
+    scanned without joining it. Consecutive chunks may repeat up to
+    max_overlap characters; a mention inside the repeated part is only
+    counted once. Returns (results, unresolved_fields); results use the
+    same item format as the LLM reply.
+    """
+    matcher, keyword_fields, value_patterns = build_keyword_matcher(fields)
+    if not matcher:
+        return [], [dict(field, name=field_name(field, i)) for i, field in enumerate(fields)]
+
+    candidates = {i: Counter() for i in value_patterns}
+    separator = re.compile(SEPARATOR)
+
+    previous = None
+    for text in ([texts] if isinstance(texts, str) else texts):
+        # Mentions that fit in the overlap were already counted in the previous chunk
+        seen_until = overlap_length(previous, text, max_overlap)
+        previous = text
+        for hit in matcher.finditer(text):
+            start = separator.match(text, hit.end()).end()
+            window_end = min(len(text), start + VALUE_WINDOW)
+            # A hit whose folding still disagrees with every keyword is skipped
+            for i in keyword_fields.get(hit.group(0).casefold(), ()):
+                value = value_patterns[i].match(text, start, window_end)
+                if value and value.group(0).strip() and value.end() > seen_until:
+                    candidates[i][value.group(0).strip()] += 1
+
+    results = []
+    unresolved = []
+    for i, field in enumerate(fields):
+        counts = candidates.get(i)
+        if counts:
+            value, hits = counts.most_common(1)[0]
+            share = hits / sum(counts.values())
+            # A lone keyword hit ("total 5 items") is weak evidence unless the
+            # config spelled out the value's pattern; agreeing mentions are strong
+            if hits > 1:
+                confidence = round(0.95 * share, 2)
+            elif field.get('pattern'):
+                confidence = round(0.9 * share, 2)
+            else:
+                confidence = SINGLE_MENTION_CONFIDENCE
+            if confidence >= LOCAL_CONFIDENCE_THRESHOLD:
+                results.append({
+                    "field": field_name(field, i),
+                    "value": value,
+                    "type": "concise",
+                    "confidence": confidence
+                })
+                continue
+        unresolved.append(dict(field, name=field_name(field, i)))
+
+    return results, unresolved
@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+import yaml
+
+# Configuration
+MODEL_ROUTES_FILE = os.getenv("MODEL_ROUTES_FILE")  # optional YAML/JSON routing table
+STATS_WINDOW = 50  # recent calls per model used for latency and error rates
+STATS_MAX_AGE = 300  # seconds; older calls are forgotten so a skipped model gets retried
+MIN_SAMPLES = 5  # calls needed before a model can be judged unhealthy
+MAX_ERROR_RATE = 0.5
+CHARS_PER_TOKEN = 4
+
+# Routes are tried in order; the first whose limits fit the request wins.
+# Limits left out (or null) are unbounded. max_prompt_tokens is checked against
+# the larger of the prompt and the whole document text: prompts are cut to a
+# fixed excerpt, so their own size would send every request to the same route.
+DEFAULT_ROUTES = [
+    {
+        "name": "small",
+        "model": "anthropic/claude-3-haiku",
+        "fallback": "openai/gpt-4o-mini",
+        "max_prompt_tokens": 4000,
+        "max_fields": 5,
+        "max_detailed_fields": 0,
+        "latency_slo": 5,  # seconds at p95 before the fallback takes over
+        "timeout": 30
+    },
+    {
+        "name": "medium",
+        "model": "anthropic/claude-3.5-sonnet",
+        "fallback": "anthropic/claude-3-haiku",
+        "max_prompt_tokens": 16000,
+        "max_fields": 20,
+        "max_detailed_fields": 5,
+        "latency_slo": 30,
+        "timeout": 120
+    },
+    {
+        "name": "large",
+        "model": "anthropic/claude-3-opus",
+        "fallback": "anthropic/claude-3.5-sonnet",
+        "latency_slo": 120,
+        "timeout": 300
+    }
+]
+
+def load_routes(path=MODEL_ROUTES_FILE):
+    """Routing table from MODEL_ROUTES_FILE, or the built-in default"""
+    if not path:
+        return DEFAULT_ROUTES
+    with open(path, 'r') as f:
+        routes = json.load(f) if path.lower().endswith('.json') else yaml.safe_load(f)
+    if not isinstance(routes, list) or not all(isinstance(r, dict) and r.get('model') for r in routes):
+        raise ValueError("Model routes must be a list of entries with a 'model'")
+    return routes
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+class ModelStats:
+    """Rolling latency and error rate of one model"""
+
+    def __init__(self):
+        self.calls = deque(maxlen=STATS_WINDOW)  # (timestamp, latency seconds, ok)
+
+    def record(self, latency, ok):
+        self.calls.append((time.monotonic(), latency, ok))
+
+    def recent(self):
+        cutoff = time.monotonic() - STATS_MAX_AGE
+        while self.calls and self.calls[0][0] < cutoff:
+            self.calls.popleft()
+        return self.calls
+
+    def error_rate(self):
+        calls = self.recent()
+        if not calls:
+            return 0.0
+        return sum(1 for _, _, ok in calls if not ok) / len(calls)
+
+    def latency_percentile(self, percentile):
+        latencies = sorted(latency for _, latency, ok in self.recent() if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile))]
+
+    def summary(self):
+        p50 = self.latency_percentile(0.5)
+        p95 = self.latency_percentile(0.95)
+        return {
+            "calls": len(self.recent()),
+            "error_rate": round(self.error_rate(), 3),
+            "p50_seconds": round(p50, 2) if p50 is not None else None,
+            "p95_seconds": round(p95, 2) if p95 is not None else None
+        }
+
+class RoutePlan:
+    """Models to try for one LLM call, and what happened when they were tried"""
+
+    def __init__(self, router, route, models, reason, prompt_tokens, document_tokens=0):
+        self.router = router
+        self.route = route
+        self.models = models
+        self.reason = reason
+        self.prompt_tokens = prompt_tokens
+        self.document_tokens = document_tokens
+        self.attempts = []
+
+    @property
+    def timeout(self):
+        return self.route.get('timeout')
+
+    @property
+    def structured_output(self):
+        return self.route.get('structured_output', True)
+
+    def record(self, model, latency, error=None):
+        self.router.record(model, latency, error is None)
+        self.attempts.append({
+            "model": model,
+            "latency_seconds": round(latency, 2),
+            "ok": error is None,
+            **({"error": str(error)[:200]} if error else {})
+        })
+
+    def report(self):
+        return {
+            "route": self.route.get('name', self.route['model']),
+            "reason": self.reason,
+            "prompt_tokens": self.prompt_tokens,
+            "document_tokens": self.document_tokens,
+            "attempts": self.attempts
+        }
+
+class ModelRouter:
+    """Pick a model per request from the routing table, steering around unhealthy ones"""
+
+    def __init__(self, routes=None):
+        self.routes = routes or load_routes()
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, latency, ok):
+        with self._lock:
+            self.stats.setdefault(model, ModelStats()).record(latency, ok)
+
+    def health_problem(self, model, latency_slo):
+        """Why a model should be avoided right now, or None if it is healthy"""
+        with self._lock:
+            stats = self.stats.get(model)
+            if not stats or len(stats.recent()) < MIN_SAMPLES:
+                return None
+            if stats.error_rate() > MAX_ERROR_RATE:
+                return f"error rate {stats.error_rate():.0%}"
+            p95 = stats.latency_percentile(0.95)
+            if latency_slo and p95 and p95 > latency_slo:
+                return f"p95 latency {p95:.1f}s over {latency_slo}s"
+            return None
+
+    def select_route(self, prompt_tokens, fields):
+        detailed = sum(1 for field in fields if field.get('response_type') == 'detailed')
+        for route in self.routes:
+            limits = (
+                (route.get('max_prompt_tokens'), prompt_tokens),
+                (route.get('max_fields'), len(fields)),
+                (route.get('max_detailed_fields'), detailed),
+            )
+            if all(limit is None or value <= limit for limit, value in limits):
+                return route, f"{prompt_tokens} tokens, {len(fields)} fields ({detailed} detailed)"
+        return self.routes[-1], "no route fits, using the last one"
+
+    def plan(self, prompt, fields, document_size=0):
+        """Route one LLM call: primary first unless it is unhealthy, then fallback.
+
+        document_size is the length of the full text the prompt's excerpt was
+        taken from; long documents are routed by it.
+        """
+        prompt_tokens = estimate_tokens(prompt)
+        document_tokens = document_size // CHARS_PER_TOKEN + 1 if document_size else 0
+        route, reason = self.select_route(max(prompt_tokens, document_tokens), fields)
+        models = [route['model']] + ([route['fallback']] if route.get('fallback') else [])
+
+        problem = self.health_problem(route['model'], route.get('latency_slo'))
+        if problem and len(models) > 1:
+            models.reverse()
+            reason += f"; primary {route['model']} tried last: {problem}"
+        return RoutePlan(self, route, models, reason, prompt_tokens, document_tokens)
+
+    def summary(self):
+        with self._lock:
+            return {model: stats.summary() for model, stats in self.stats.items()}
@@ -0,0 +1,170 @@
+import os
+import re
+import time
+import uuid
+import sqlite3
+import hashlib
+import tempfile
+import threading
+
+# Configuration
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", os.path.join(tempfile.gettempdir(), "mvp_search.db"))
+SEARCH_RESULT_LIMIT = 50
+SNIPPET_TOKENS = 24
+SCHEMA_VERSION = 2  # indexes written with another version are rebuilt
+
+# A chunk is stored once per session, however many batches (re-analyses of
+# the same uploads) contain it; batch_chunks records what each batch holds.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunk_meta (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    source TEXT,
+    page INTEGER,
+    chunk_no INTEGER NOT NULL,
+    chunk_hash TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    UNIQUE (session_id, chunk_hash)
+);
+CREATE INDEX IF NOT EXISTS chunk_meta_expiry ON chunk_meta (expires_at);
+CREATE TABLE IF NOT EXISTS batch_chunks (
+    batch_id TEXT NOT NULL,
+    chunk_id INTEGER NOT NULL,
+    chunk_no INTEGER NOT NULL,
+    PRIMARY KEY (batch_id, chunk_id)
+);
+CREATE INDEX IF NOT EXISTS batch_chunks_chunk ON batch_chunks (chunk_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunk_text USING fts5(content, tokenize='porter unicode61');
+"""
+
+_local = threading.local()
+
+def connection():
+    """Per-thread connection to the index, created on first use"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(SEARCH_INDEX_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        create_schema(conn)
+        _local.conn = conn
+    return conn
+
+def create_schema(conn):
+    """Create the index tables, dropping any left by an older SCHEMA_VERSION.
+
+    The index only holds session-lived text, so nothing worth migrating is lost.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            for table in ("chunk_meta", "batch_chunks", "chunk_text"):
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+        for statement in SCHEMA.split(';'):
+            if statement.strip():
+                conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+def fts_query(text, operator="AND"):
+    """Turn free text into a safe FTS5 query of quoted terms"""
+    terms = re.findall(r'\w+', text or '')
+    return f" {operator} ".join('"' + term + '"' for term in terms)
+
+def index_spool(session_id, spool, expires_at):
+    """Index every chunk of a spool as one batch; returns the batch ID"""
+    batch_id = str(uuid.uuid4())
+    conn = connection()
+
+    with conn:
+        for chunk_no, (text, metadata) in enumerate(spool.iter_records()):
+            chunk_hash = hashlib.sha1(text.encode('utf-8')).hexdigest()
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO chunk_meta "
+                "(session_id, source, page, chunk_no, chunk_hash, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, metadata.get('source'), metadata.get('page'), chunk_no,
+                 chunk_hash, expires_at.timestamp())
+            )
+            if cursor.rowcount:
+                chunk_id = cursor.lastrowid
+                conn.execute("INSERT INTO chunk_text (rowid, content) VALUES (?, ?)", (chunk_id, text))
+            else:
+                # Already indexed for this session: a re-analysis, or a chunk that
+                # overlapping splits repeated verbatim
+                chunk_id = conn.execute(
+                    "SELECT id FROM chunk_meta WHERE session_id = ? AND chunk_hash = ?",
+                    (session_id, chunk_hash)
+                ).fetchone()[0]
+            conn.execute("INSERT OR IGNORE INTO batch_chunks (batch_id, chunk_id, chunk_no) "
+                         "VALUES (?, ?, ?)", (batch_id, chunk_id, chunk_no))
+
+    return batch_id
+
+def search(session_id, query, limit=20):
+    """Ranked snippets from a session's indexed text"""
+    match = fts_query(query)
+    if not match:
+        return []
+
+    rows = connection().execute(
+        "SELECT m.source, m.page, m.chunk_no, "
+        f"snippet(chunk_text, 0, '[', ']', '…', {SNIPPET_TOKENS}), bm25(chunk_text) AS score "
+        "FROM chunk_text JOIN chunk_meta m ON m.id = chunk_text.rowid "
+        "WHERE chunk_text MATCH ? AND m.session_id = ? AND m.expires_at > ? "
+        "ORDER BY score LIMIT ?",
+        (match, session_id, time.time(), max(1, min(limit, SEARCH_RESULT_LIMIT)))
+    ).fetchall()
+
+    return [
+        {"source": source, "page": page, "chunk": chunk_no, "snippet": snippet,
+         "score": round(-score, 3)}  # bm25 is lower-is-better
+        for source, page, chunk_no, snippet, score in rows
+    ]
+
+def select_chunks(batch_id, fields, max_chars, separator="\n\n"):
+    """Text of the chunks in a batch most relevant to the fields, in document order.
+
+    Returns None when nothing matches so the caller can fall back to the
+    start of the text.
+    """
+    terms = " ".join(
+        " ".join([str(field.get('name', ''))] + [str(k) for k in field.get('keywords', [])])
+        for field in fields
+    )
+    match = fts_query(terms, operator="OR")
+    if not match:
+        return None
+
+    rows = connection().execute(
+        "SELECT b.chunk_no, chunk_text.content FROM chunk_text "
+        "JOIN batch_chunks b ON b.chunk_id = chunk_text.rowid "
+        "WHERE chunk_text MATCH ? AND b.batch_id = ? ORDER BY bm25(chunk_text)",
+        (match, batch_id)
+    )
+
+    selected = []
+    size = 0
+    for chunk_no, content in rows:
+        if size + len(content) > max_chars and selected:
+            break
+        selected.append((chunk_no, content))
+        size += len(content) + len(separator)
+
+    if not selected:
+        return None
+    return separator.join(content for _, content in sorted(selected))[:max_chars]
+
+def purge_expired():
+    """Drop chunks whose session has expired"""
+    conn = connection()
+    now = time.time()
+    with conn:
+        conn.execute("DELETE FROM chunk_text WHERE rowid IN "
+                     "(SELECT id FROM chunk_meta WHERE expires_at <= ?)", (now,))
+        conn.execute("DELETE FROM batch_chunks WHERE chunk_id IN "
+                     "(SELECT id FROM chunk_meta WHERE expires_at <= ?)", (now,))
+        conn.execute("DELETE FROM chunk_meta WHERE expires_at <= ?", (now,))
@@ -0,0 +1,144 @@
+import json
+
+# Configuration
+MAX_REPAIR_ATTEMPTS = 64  # backtracking steps when closing a truncated reply
+MAX_OBJECT_CANDIDATES = 16  # balanced but invalid objects skipped before giving up
+
+def field_name(field, index):
+    """Name of a config field, matching the fallback used in the prompt"""
+    return field.get('name', f'field_{index+1}')
+
+def build_response_schema(fields):
+    """JSON schema for the analysis reply, generated from the config fields"""
+    names = [field_name(field, i) for i, field in enumerate(fields)]
+    return {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "field": {"type": "string", "enum": names},
+                        "value": {"type": "string"},
+                        "type": {"type": "string", "enum": ["concise", "detailed"]},
+                        "confidence": {"type": "number"}
+                    },
+                    "required": ["field", "value", "type", "confidence"],
+                    "additionalProperties": False
+                }
+            }
+        },
+        "required": ["results"],
+        "additionalProperties": False
+    }
+
+def scan_json(text, offset=0):
+    """Single pass over the first JSON object in text at or after offset.
+
+    Returns (start, end, safe_points): start is the index of the opening brace
+    (-1 if there is none), end is the index just past the object if it closed,
+    else None, and safe_points are (index, closing_brackets) positions where
+    the text so far can be closed off.
+    """
+    start = text.find('{', offset)
+    if start == -1:
+        return start, None, []
+
+    stack = []
+    safe_points = []
+    in_string = False
+    escaped = False
+
+    for i in range(start, len(text)):
+        char = text[i]
+
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+                safe_points.append((i + 1, ''.join(stack)))
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+            safe_points.append((i + 1, ''.join(stack)))
+        elif char in '}]':
+            if not stack or stack[-1] != char:
+                break
+            stack.pop()
+            if not stack:
+                return start, i + 1, safe_points
+            safe_points.append((i + 1, ''.join(stack)))
+        elif char == ',':
+            # Everything before a comma is a complete member
+            safe_points.append((i, ''.join(stack)))
+
+    return start, None, safe_points
+
+def repair_json(text):
+    """Parse the JSON object in an LLM reply, closing it off if it was truncated.
+
+    Returns (parsed, truncated); parsed is None when nothing usable was found.
+    """
+    start, end, safe_points = scan_json(text)
+    if start == -1:
+        return None, False
+
+    # Braces in leading prose ("see {below}") close without being JSON;
+    # move on to the next brace until an object parses or one is truncated
+    for _ in range(MAX_OBJECT_CANDIDATES):
+        if end is None:
+            break
+        try:
+            return json.loads(text[start:end]), False
+        except json.JSONDecodeError:
+            pass
+        candidate = scan_json(text, start + 1)
+        if candidate[0] == -1:
+            break
+        start, end, safe_points = candidate
+
+    # Walk back through safe points until the closed-off prefix parses
+    for index, closing in reversed(safe_points[-MAX_REPAIR_ATTEMPTS:]):
+        candidate = text[start:index].rstrip().rstrip(',')
+        try:
+            return json.loads(candidate + closing[::-1]), True
+        except json.JSONDecodeError:
+            continue
+
+    return None, True
+
+def missing_fields(parsed, fields):
+    """Config fields that have no extracted value in the parsed reply.
+
+    Returned fields carry their resolved name so a follow-up prompt built from
+    the subset uses the same names as the original one.
+    """
+    answered = {
+        item.get('field')
+        for item in (parsed or {}).get('results', [])
+        if isinstance(item, dict) and 'value' in item
+    }
+    return [
+        dict(field, name=field_name(field, i))
+        for i, field in enumerate(fields)
+        if field_name(field, i) not in answered
+    ]
+
+def merge_results(parsed, extra):
+    """Add re-requested field results to a reply, replacing incomplete entries"""
+    merged = dict(parsed or {})
+    extra_items = [item for item in (extra or {}).get('results', []) if isinstance(item, dict)]
+    extra_names = {item.get('field') for item in extra_items}
+    kept = [
+        item for item in merged.get('results', [])
+        if isinstance(item, dict) and 'value' in item and item.get('field') not in extra_names
+    ]
+    merged['results'] = kept + extra_items
+    return merged
@@ -0,0 +1,136 @@
+import asyncio
+import threading
+
+import pytest
+from werkzeug.exceptions import TooManyRequests
+
+import admission
+from admission import AdmissionController, RequestCost
+
+def llm_cost(units=1):
+    return RequestCost(pages=units * admission.PAGES_PER_UNIT)
+
+@pytest.mark.parametrize("cost, work_class, units", [
+    (RequestCost(pages=1), "llm", 1),
+    (RequestCost(pages=admission.PAGES_PER_UNIT + 1), "llm", 2),
+    (RequestCost(pages=10, ocr_pages=7), "ocr", 7),
+    (RequestCost(), "llm", 1),
+])
+def test_request_cost(cost, work_class, units):
+    assert (cost.work_class, cost.units) == (work_class, units)
+
+def test_sessions_take_turns():
+    controller = AdmissionController({"llm": 1})
+    first = controller.submit("a", llm_cost())
+    queued = [controller.submit("a", llm_cost()), controller.submit("a", llm_cost()),
+              controller.submit("b", llm_cost())]
+    order = [first]
+
+    for _ in queued:
+        controller.release(order[-1])
+        order.append(next(t for t in queued if t.granted and t not in order))
+
+    assert [t.session_id for t in order] == ["a", "a", "b", "a"]
+
+def test_head_of_line_waits_for_room():
+    controller = AdmissionController({"llm": 4})
+    running = controller.submit("a", llm_cost(3))
+    large = controller.submit("b", llm_cost(2))
+    small = controller.submit("c", llm_cost(1))
+
+    assert running.granted
+    assert not large.granted and not small.granted
+
+    controller.release(running)
+    assert large.granted and small.granted
+
+def test_oversized_request_runs_alone():
+    controller = AdmissionController({"llm": 4})
+    ticket = controller.submit("a", llm_cost(10))
+
+    assert ticket.granted
+    assert ticket.units == 4
+    assert controller.stats()["llm"]["in_flight"] == 4
+
+def test_per_session_queue_limit(monkeypatch):
+    monkeypatch.setattr(admission, "MAX_QUEUED_PER_SESSION", 1)
+    controller = AdmissionController({"llm": 1})
+    controller.submit("a", llm_cost())
+    controller.submit("a", llm_cost())
+
+    with pytest.raises(TooManyRequests):
+        controller.submit("a", llm_cost())
+    # Other sessions are not affected by one session's backlog
+    controller.submit("b", llm_cost())
+    assert controller.stats()["llm"]["rejected"] == 1
+
+def test_saturated_class_rejects_with_retry_after(monkeypatch):
+    monkeypatch.setattr(admission, "MAX_QUEUE_WAIT", 5)
+    controller = AdmissionController({"llm": 1})
+    controller.classes["llm"].avg_unit_time = 10.0
+    controller.submit("a", llm_cost())
+
+    with pytest.raises(TooManyRequests) as rejected:
+        controller.submit("b", llm_cost())
+    assert rejected.value.retry_after >= 10
+
+def test_cancel_queued_ticket():
+    controller = AdmissionController({"llm": 1})
+    running = controller.submit("a", llm_cost())
+    waiting = controller.submit("b", llm_cost())
+
+    controller.cancel(waiting)
+    stats = controller.stats()["llm"]
+    assert (stats["queue_depth"], stats["queued_sessions"], stats["rejected"]) == (0, 0, 1)
+
+    controller.release(running)
+    assert not waiting.granted
+    assert controller.stats()["llm"]["in_flight"] == 0
+
+def test_cancel_granted_ticket_releases_it():
+    controller = AdmissionController({"llm": 1})
+    running = controller.submit("a", llm_cost())
+    waiting = controller.submit("b", llm_cost())
+
+    controller.cancel(running)
+    assert waiting.granted
+    assert controller.stats()["llm"]["in_flight"] == 1
+
+def test_admit_times_out_with_429(monkeypatch):
+    monkeypatch.setattr(admission, "MAX_QUEUE_WAIT", 1)
+    controller = AdmissionController({"llm": 1})
+    controller.submit("a", llm_cost())
+
+    with pytest.raises(TooManyRequests):
+        with controller.admit("b", llm_cost()):
+            pass
+    assert controller.stats()["llm"]["queue_depth"] == 0
+
+def test_admit_async_wakes_on_release_from_another_thread():
+    controller = AdmissionController({"llm": 1})
+    running = controller.submit("a", llm_cost())
+
+    async def wait_for_turn():
+        threading.Timer(0.05, controller.release, [running]).start()
+        async with controller.admit_async("b", llm_cost()) as ticket:
+            return ticket.granted
+
+    assert asyncio.run(wait_for_turn())
+    assert controller.stats()["llm"]["in_flight"] == 0
+
+def test_admit_async_cancelled_while_queued_withdraws_ticket():
+    controller = AdmissionController({"llm": 1})
+    running = controller.submit("a", llm_cost())
+
+    async def cancel_waiter():
+        waiter = asyncio.ensure_future(controller.admit_async("b", llm_cost()).__aenter__())
+        await asyncio.sleep(0.05)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(cancel_waiter())
+    assert controller.stats()["llm"]["queue_depth"] == 0
+
+    controller.release(running)
+    assert controller.stats()["llm"]["in_flight"] == 0
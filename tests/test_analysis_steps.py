@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+import app
+from text_spool import TextSpool
+
+TOTAL = {"name": "total_amount", "keywords": ["total amount"], "response_type": "concise"}
+PARTY = {"name": "party", "keywords": ["party"], "response_type": "concise"}
+
+@pytest.fixture
+def spool():
+    spool = TextSpool()
+    spool.write("Total amount: 1234.56 due. Later: total amount 1234.56 again.")
+    with spool.finalize() as spool:
+        yield spool
+
+def drive(steps, replies):
+    """Answer each LLM request with the next reply; returns the result and the plans"""
+    plans = []
+    try:
+        prompt, schema, plan = next(steps)
+        for reply in replies:
+            plans.append(plan)
+            prompt, schema, plan = steps.send(reply)
+    except StopIteration as done:
+        return done.value, plans
+    raise AssertionError("analysis asked for more replies than given")
+
+def test_llm_results_merge_with_local_ones(spool):
+    reply = json.dumps({"results": [{"field": "party", "value": "ACME", "type": "concise",
+                                     "confidence": 0.8}]})
+
+    result, plans = drive(app.analysis_steps([TOTAL, PARTY], spool), [reply])
+
+    assert [item["field"] for item in result["data"]["results"]] == ["total_amount", "party"]
+    assert result["analysis"]["local_fields"] == ["total_amount"]
+    assert len(result["analysis"]["routing"]) == len(plans) == 1
+
+def test_unparseable_reply_keeps_local_results(spool):
+    result, _ = drive(app.analysis_steps([TOTAL, PARTY], spool), ["not json at all"])
+
+    assert result["status"] == "partial_success"
+    assert [item["field"] for item in result["local_results"]] == ["total_amount"]
+    assert result["analysis"]["missing_fields"] == ["party"]
+    assert result["analysis"]["routing"][0]["route"]
+
+def test_first_request_failure_reports_routing(spool):
+    steps = app.analysis_steps([TOTAL, PARTY], spool)
+    next(steps)
+
+    with pytest.raises(app.AnalysisError) as failure:
+        steps.throw(ValueError("every model failed"))
+
+    body = failure.value.body()
+    assert body["message"] == "Analysis failed: every model failed"
+    assert body["analysis"]["local_fields"] == ["total_amount"]
+    assert len(body["analysis"]["routing"]) == 1
+
+def test_long_documents_route_by_full_text_size():
+    spool = TextSpool()
+    spool.write("Party: ACME. " * 20000)
+    with spool.finalize() as spool:
+        prompt, schema, plan = next(app.analysis_steps([PARTY], spool))
+
+    # The prompt holds only an excerpt, but the route reflects the whole text
+    assert plan.prompt_tokens < 5000 < plan.document_tokens
+    assert plan.route["name"] == "large"
+
+def test_unavailable_llm_returns_500_with_routing(monkeypatch, spool):
+    def fail(*args, **kwargs):
+        raise ValueError("model unavailable")
+    monkeypatch.setattr(app, "query_openrouter", fail)
+    session_id = app.create_session({"fields": [PARTY]})["session_id"]
+    spool.document_count = 1
+    monkeypatch.setattr(app, "build_text_spool", lambda documents: spool)
+
+    response = app.app.test_client().post("/upload_documents", data={
+        "session_id": session_id, "document_files": []})
+    app.sessions.pop(session_id, None)
+
+    assert response.status_code == 500
+    routing = response.get_json()["analysis"]["routing"]
+    assert [attempt["ok"] for attempt in routing[0]["attempts"]] == [False, False]
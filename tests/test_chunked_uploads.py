@@ -0,0 +1,113 @@
+import hashlib
+
+import pytest
+
+import app
+
+CONTENT = b"Invoice total amount: 1,234.56 EUR\n" * 40
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "UPLOAD_ROOT", str(tmp_path))
+    return app.app.test_client()
+
+@pytest.fixture
+def session_id():
+    session_id = app.create_session({"fields": []})["session_id"]
+    yield session_id
+    app.sessions.pop(session_id, None)
+
+def start(client, session_id, content=CONTENT, filename="invoice.txt"):
+    return client.post("/uploads", json={
+        "session_id": session_id,
+        "filename": filename,
+        "size": len(content),
+        "sha256": hashlib.sha256(content).hexdigest(),
+    })
+
+def put(client, upload_id, offset, data):
+    return client.put(f"/uploads/{upload_id}?offset={offset}", data=data)
+
+def test_upload_in_chunks(client, session_id):
+    created = start(client, session_id)
+    assert created.status_code == 201
+    upload_id = created.get_json()["upload_id"]
+
+    first = put(client, upload_id, 0, CONTENT[:500])
+    assert first.get_json()["received"] == 500
+    assert first.get_json()["status"] == "uploading"
+
+    last = put(client, upload_id, 500, CONTENT[500:])
+    assert last.get_json()["status"] == "complete"
+
+    upload = app.get_upload(upload_id)
+    assert upload["extraction"] is not None
+    assert app.get_completed_uploads(session_id, [upload_id]) == [upload]
+    with app.collect_uploaded_text([upload]) as spool:
+        assert "1,234.56" in "".join(spool.iter_chunks())
+
+def test_resume_after_interrupted_chunk(client, session_id):
+    upload_id = start(client, session_id).get_json()["upload_id"]
+    put(client, upload_id, 0, CONTENT[:300])
+
+    status = client.get(f"/uploads/{upload_id}").get_json()
+    assert status["received"] == 300
+
+    resumed = put(client, upload_id, status["received"], CONTENT[300:])
+    assert resumed.get_json()["status"] == "complete"
+
+def test_out_of_sync_chunk_gets_409(client, session_id):
+    upload_id = start(client, session_id).get_json()["upload_id"]
+    put(client, upload_id, 0, CONTENT[:300])
+
+    retried = put(client, upload_id, 0, CONTENT[:300])
+    assert retried.status_code == 409
+    assert retried.get_json()["received"] == 300
+
+def test_chunk_past_declared_size(client, session_id):
+    upload_id = start(client, session_id).get_json()["upload_id"]
+    assert put(client, upload_id, 0, CONTENT + b"extra").status_code == 400
+
+def test_checksum_mismatch_restarts_upload(client, session_id):
+    upload_id = start(client, session_id).get_json()["upload_id"]
+
+    corrupt = put(client, upload_id, 0, CONTENT[:-1] + b"?")
+    assert corrupt.status_code == 422
+    status = client.get(f"/uploads/{upload_id}").get_json()
+    assert (status["received"], status["status"]) == (0, "uploading")
+
+    assert put(client, upload_id, 0, CONTENT).get_json()["status"] == "complete"
+
+def test_same_content_is_deduplicated(client, session_id):
+    upload_id = start(client, session_id).get_json()["upload_id"]
+    put(client, upload_id, 0, CONTENT)
+
+    again = start(client, session_id, filename="copy.txt")
+    assert again.status_code == 200
+    assert again.get_json()["upload_id"] == upload_id
+    assert again.get_json()["status"] == "complete"
+    assert app.get_upload(upload_id)["extraction"] is not None
+
+def test_incomplete_upload_cannot_be_analyzed(client, session_id):
+    upload_id = start(client, session_id).get_json()["upload_id"]
+    put(client, upload_id, 0, CONTENT[:100])
+
+    response = client.post("/upload_documents", data={
+        "session_id": session_id, "upload_ids": [upload_id]})
+    assert response.status_code == 409
+
+def test_complete_upload_without_extraction_is_409(client, session_id):
+    upload_id = start(client, session_id).get_json()["upload_id"]
+    upload = app.get_upload(upload_id)
+    # The state a racing request could observe if completion and extraction were not atomic
+    upload["status"] = "complete"
+
+    response = client.post("/upload_documents", data={
+        "session_id": session_id, "upload_ids": [upload_id]})
+    assert response.status_code == 409
+
+def test_unknown_upload(client):
+    assert client.get("/uploads/missing").status_code == 404
+
+def test_rejects_unsupported_file_type(client, session_id):
+    assert start(client, session_id, filename="image.png").status_code == 400
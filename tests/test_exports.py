@@ -0,0 +1,77 @@
+import csv
+import io
+import json
+import xml.etree.ElementTree as ET
+
+import pytest
+from docx import Document
+
+import exports
+from exports import EXPORT_FORMATS, iter_export, render_export, result_hash
+
+RESULT = {
+    "status": "success",
+    "results": [
+        {"field": "invoice_number", "type": "string", "confidence": 0.9, "value": "INV-001"},
+        {"field": "total_amount", "type": "amount", "confidence": 0.8, "value": "1,234.56 €"},
+        {"field": "Résumé ✓", "type": "string", "confidence": 0.5, "value": "naïve 日本"},
+        "not a field",
+    ],
+}
+
+def test_json():
+    assert json.loads(render_export(RESULT, "json")) == RESULT
+
+def test_text():
+    text = render_export(RESULT, "text").decode("utf-8")
+    assert text.count("Result ") == 3
+    assert "Field: Résumé ✓" in text and "Value: naïve 日本" in text
+
+def test_xml():
+    root = ET.fromstring(render_export(RESULT, "xml"))
+    assert [r.findtext("Field") for r in root] == ["invoice_number", "total_amount", "Résumé ✓"]
+
+def test_csv():
+    rows = list(csv.reader(io.StringIO(render_export(RESULT, "csv").decode("utf-8"))))
+    assert rows[0] == ["field", "type", "confidence", "value"]
+    assert rows[2] == ["total_amount", "amount", "0.8", "1,234.56 €"]
+    assert len(rows) == 4
+
+def test_docx():
+    doc = Document(io.BytesIO(render_export(RESULT, "docx")))
+    paragraphs = [p.text for p in doc.paragraphs]
+    assert "invoice_number: INV-001" in paragraphs
+    assert "Résumé ✓: naïve 日本" in paragraphs
+
+def test_pdf_with_several_items():
+    # Each entry must start back at the left margin, or the second one has no room
+    items = [{"field": f"field_{i}", "value": "x" * 200} for i in range(40)]
+    rendered = render_export({"results": items}, "pdf")
+    assert rendered.startswith(b"%PDF") and rendered.rstrip().endswith(b"%%EOF")
+
+def test_pdf_replaces_unencodable_text():
+    assert render_export(RESULT, "pdf").startswith(b"%PDF")
+
+@pytest.mark.parametrize("export_format", sorted(EXPORT_FORMATS))
+def test_malformed_results(export_format):
+    for data in ({"status": "partial_success"}, {"results": "oops"}, []):
+        assert isinstance(exports.EXPORT_FORMATS[export_format][0](data), bytes)
+
+def test_unsupported_format():
+    with pytest.raises(ValueError):
+        render_export(RESULT, "yaml")
+
+def test_rendered_exports_are_cached(monkeypatch):
+    calls = []
+    renderer, mime, extension = EXPORT_FORMATS["csv"]
+    monkeypatch.setitem(EXPORT_FORMATS, "csv",
+                        (lambda data: calls.append(data) or renderer(data), mime, extension))
+    data = {"results": [{"field": "cached", "value": 1}]}
+
+    first = render_export(data, "csv")
+    assert render_export(data, "csv", result_hash(data)) is first
+    assert len(calls) == 1
+
+def test_iter_export(monkeypatch):
+    monkeypatch.setattr(exports, "EXPORT_STREAM_CHUNK", 4)
+    assert list(iter_export(b"abcdefghij")) == [b"abcd", b"efgh", b"ij"]
@@ -0,0 +1,95 @@
+import re
+
+import pytest
+
+from local_extraction import VALUE_PATTERNS, infer_value_type, overlap_length, pre_extract
+
+TOTAL = {"name": "total_amount", "keywords": ["total amount", "total"], "response_type": "concise"}
+
+@pytest.mark.parametrize("text, expected", [
+    ("1234.56", "1234.56"),
+    ("$12345.00", "$12345.00"),
+    ("1,234,567.89 due", "1,234,567.89"),
+    ("$1,234", "$1,234"),
+    ("€ 99.5", "€ 99.5"),
+    ("USD 1,000", "USD 1,000"),
+    ("250 EUR", "250 EUR"),
+    ("-42.10", "-42.10"),
+    ("5", "5"),
+])
+def test_amount_pattern(text, expected):
+    assert re.compile(VALUE_PATTERNS["amount"]).match(text).group(0) == expected
+
+@pytest.mark.parametrize("text, expected", [
+    ("2024-03-01", "2024-03-01"),
+    ("01/03/2024", "01/03/2024"),
+    ("1 March 2024", "1 March 2024"),
+    ("March 1, 2024", "March 1, 2024"),
+])
+def test_date_pattern(text, expected):
+    assert re.compile(VALUE_PATTERNS["date"]).match(text).group(0) == expected
+
+@pytest.mark.parametrize("field, expected", [
+    ({"name": "total_amount"}, "amount"),
+    ({"name": "issue_date"}, "date"),
+    ({"name": "invoice", "keywords": ["invoice number"]}, "id"),
+    ({"name": "amount", "value_type": "date"}, "date"),
+    ({"name": "due"}, None),
+    ({"name": "total date"}, None),
+])
+def test_infer_value_type(field, expected):
+    assert infer_value_type(field) == expected
+
+def test_agreeing_mentions_resolve_locally():
+    results, unresolved = pre_extract([TOTAL], "Total amount: 1234.56. Later: total amount 1234.56")
+
+    assert results == [{"field": "total_amount", "value": "1234.56", "type": "concise", "confidence": 0.95}]
+    assert unresolved == []
+
+@pytest.mark.parametrize("text", ["Total amount: 1234.56", "total 5 items shipped"])
+def test_single_mention_goes_to_llm(text):
+    results, unresolved = pre_extract([TOTAL], text)
+
+    assert results == []
+    assert [field["name"] for field in unresolved] == ["total_amount"]
+
+def test_single_mention_with_explicit_pattern_resolves():
+    field = {"name": "po", "keywords": ["PO"], "pattern": r"PO-\d{6}"}
+
+    results, _ = pre_extract([field], "Reference PO: PO-123456 attached")
+
+    assert results == [{"field": "po", "value": "PO-123456", "type": "concise", "confidence": 0.9}]
+
+def test_disagreeing_mentions_go_to_llm():
+    results, _ = pre_extract([TOTAL], "Total amount 100.00, revised total amount 250.00")
+
+    assert results == []
+
+def test_overlapping_chunks_count_a_mention_once():
+    first = "Header text " * 10 + "Total amount: 1234.56 was invoiced."
+    second = "Total amount: 1234.56 was invoiced. Remaining text of the next chunk."
+
+    assert overlap_length(first, second, 400) == len("Total amount: 1234.56 was invoiced.")
+    assert pre_extract([TOTAL], [first, second], max_overlap=400)[0] == []
+    # Without overlap information the repeat looks like a second mention
+    assert pre_extract([TOTAL], [first, second])[0][0]["value"] == "1234.56"
+
+def test_overlap_length_without_shared_text():
+    assert overlap_length("abc def", "ghi jkl", 400) == 0
+    assert overlap_length(None, "ghi jkl", 400) == 0
+
+def test_detailed_fields_are_never_resolved_locally():
+    field = {"name": "total", "keywords": ["total"], "response_type": "detailed"}
+
+    results, unresolved = pre_extract([field], "total 10. total 10.")
+
+    assert results == []
+    assert unresolved == [field]
+
+def test_keyword_matched_through_unicode_case_folding():
+    field = {"name": "case_id", "keywords": ["case id"], "pattern": r"C-\d{4}"}
+
+    # IGNORECASE matches "ſ" (long s) to "s", though "ſ".lower() stays "ſ"
+    results, _ = pre_extract([field], "Caſe ID: C-1234. CASE ID C-1234")
+
+    assert results[0]["value"] == "C-1234"
@@ -0,0 +1,69 @@
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import search_index
+from text_spool import TextSpool
+
+EXPIRES = datetime.now() + timedelta(hours=1)
+
+@pytest.fixture(autouse=True)
+def index_path(monkeypatch, tmp_path):
+    path = str(tmp_path / "search.db")
+    monkeypatch.setattr(search_index, "SEARCH_INDEX_PATH", path)
+    monkeypatch.setattr(search_index, "_local", threading.local())
+    return path
+
+def make_spool(*chunks):
+    spool = TextSpool()
+    for i, text in enumerate(chunks):
+        spool.write(text, {"source": "contract.pdf", "page": i + 1})
+    return spool.finalize()
+
+def test_search_ranks_session_text():
+    with make_spool("The termination clause allows notice.", "Payment terms are net 30.") as spool:
+        search_index.index_spool("s1", spool, EXPIRES)
+
+    hits = search_index.search("s1", "termination")
+    assert [(hit["source"], hit["page"]) for hit in hits] == [("contract.pdf", 1)]
+    assert "[termination]" in hits[0]["snippet"]
+    assert search_index.search("other", "termination") == []
+
+def test_reanalysis_does_not_duplicate_hits():
+    for _ in range(3):
+        with make_spool("The termination clause allows notice.", "Payment terms are net 30.") as spool:
+            search_index.index_spool("s1", spool, EXPIRES)
+
+    assert len(search_index.search("s1", "termination")) == 1
+
+def test_each_batch_selects_its_own_chunks():
+    with make_spool("Invoice total 100.", "Unrelated notes.") as spool:
+        first = search_index.index_spool("s1", spool, EXPIRES)
+    # A later batch shares a chunk already stored for the first one
+    with make_spool("Shipping address Berlin.", "Invoice total 100.") as spool:
+        second = search_index.index_spool("s1", spool, EXPIRES)
+
+    fields = [{"name": "total", "keywords": ["invoice"]}, {"name": "address", "keywords": ["shipping"]}]
+    assert search_index.select_chunks(first, fields, 1000) == "Invoice total 100."
+    assert search_index.select_chunks(second, fields, 1000) == \
+        "Shipping address Berlin.\n\nInvoice total 100."
+
+def test_expired_chunks_are_purged():
+    with make_spool("Expired termination clause.") as spool:
+        batch_id = search_index.index_spool("s1", spool, datetime.now() - timedelta(seconds=1))
+
+    search_index.purge_expired()
+    assert search_index.search("s1", "termination") == []
+    assert search_index.select_chunks(batch_id, [{"name": "termination"}], 1000) is None
+
+def test_index_from_older_schema_is_rebuilt(index_path):
+    conn = sqlite3.connect(index_path)
+    conn.execute("CREATE TABLE chunk_meta (id INTEGER PRIMARY KEY, batch_id TEXT)")
+    conn.commit()
+    conn.close()
+
+    with make_spool("Rebuilt termination clause.") as spool:
+        search_index.index_spool("s1", spool, EXPIRES)
+    assert len(search_index.search("s1", "termination")) == 1
@@ -0,0 +1,39 @@
+import pytest
+
+from structured_output import repair_json, missing_fields, merge_results
+
+@pytest.mark.parametrize("text, expected, truncated", [
+    ('{"results": []}', {"results": []}, False),
+    ('Here you go:\n{"results": []}\nHope this helps', {"results": []}, False),
+    ('Note {see below}: {"results": []}', {"results": []}, False),
+    ('{x} and {y}, then {"a": 1}', {"a": 1}, False),
+    ('{"a": {"b": [1, 2]}}', {"a": {"b": [1, 2]}}, False),
+    ('{"results": [{"field": "a", "value": "1"}, {"field": "b", "val',
+     {"results": [{"field": "a", "value": "1"}, {"field": "b"}]}, True),
+    ('{"results": [{"field": "a", "value": "x {y', {"results": [{"field": "a"}]}, True),
+    ('Note {see below}: {"results": [{"field": "a", "value": "1"}, ',
+     {"results": [{"field": "a", "value": "1"}]}, True),
+])
+def test_repair_json(text, expected, truncated):
+    assert repair_json(text) == (expected, truncated)
+
+@pytest.mark.parametrize("text", ["", "no json here"])
+def test_repair_json_without_object(text):
+    assert repair_json(text) == (None, False)
+
+def test_missing_fields_keep_resolved_names():
+    fields = [{"name": "a"}, {"keywords": ["total"]}, {"name": "c"}]
+    parsed = {"results": [{"field": "a", "value": "1"}, {"field": "c"}]}
+
+    missing = missing_fields(parsed, fields)
+
+    assert [field["name"] for field in missing] == ["field_2", "c"]
+    assert missing[0]["keywords"] == ["total"]
+
+def test_merge_results_replaces_incomplete_entries():
+    parsed = {"results": [{"field": "a", "value": "1"}, {"field": "b"}]}
+    extra = {"results": [{"field": "b", "value": "2"}]}
+
+    merged = merge_results(parsed, extra)
+
+    assert merged["results"] == [{"field": "a", "value": "1"}, {"field": "b", "value": "2"}]
@@ -0,0 +1,100 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+import app
+from app import ArchiveError, iter_zip_members, release_zip_member
+
+def make_zip(members, compression=zipfile.ZIP_DEFLATED):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+def read_members(source):
+    contents = {}
+    for filename, member in iter_zip_members(source):
+        try:
+            if isinstance(member, io.BytesIO):
+                contents[filename] = member.read()
+            else:
+                with open(member, "rb") as f:
+                    contents[filename] = f.read()
+        finally:
+            release_zip_member(member)
+    return contents
+
+def test_supported_members_are_yielded():
+    source = make_zip({
+        "docs/a.txt": b"alpha",
+        "b.txt": b"beta",
+        "image.png": b"not a document",
+        ".hidden.txt": b"skip",
+        "__MACOSX/._a.txt": b"skip",
+    })
+    assert read_members(source) == {"a.txt": b"alpha", "b.txt": b"beta"}
+
+def test_invalid_zip():
+    with pytest.raises(ArchiveError, match="Invalid ZIP"):
+        list(iter_zip_members(io.BytesIO(b"not a zip")))
+
+def test_member_count_limit(monkeypatch):
+    monkeypatch.setattr(app, "MAX_ZIP_MEMBERS", 3)
+    source = make_zip({f"{i}.txt": b"x" for i in range(4)})
+    with pytest.raises(ArchiveError, match="too many files"):
+        read_members(source)
+
+def test_unsupported_members_count_towards_limit(monkeypatch):
+    monkeypatch.setattr(app, "MAX_ZIP_MEMBERS", 2)
+    source = make_zip({"a.txt": b"x", "b.png": b"x", "c.png": b"x"})
+    with pytest.raises(ArchiveError, match="too many files"):
+        read_members(source)
+
+def test_compression_ratio_limit():
+    # A megabyte of zeros deflates far past the ratio limit
+    source = make_zip({"bomb.txt": b"\0" * (1024 * 1024)})
+    with pytest.raises(ArchiveError, match="compression ratio"):
+        read_members(source)
+
+def test_total_size_limit(monkeypatch):
+    monkeypatch.setattr(app, "MAX_ZIP_TOTAL_SIZE", 150 * 1024)
+    members = {f"{i}.txt": os.urandom(64 * 1024) for i in range(3)}
+    with pytest.raises(ArchiveError, match="uncompressed limit"):
+        read_members(make_zip(members, zipfile.ZIP_STORED))
+
+def test_document_size_limit(monkeypatch):
+    monkeypatch.setattr(app, "MAX_DOCUMENT_SIZE", 64 * 1024)
+    source = make_zip({"big.txt": os.urandom(128 * 1024)}, zipfile.ZIP_STORED)
+    with pytest.raises(ArchiveError, match="big.txt exceeds"):
+        read_members(source)
+
+def test_large_member_spills_to_temp_file(monkeypatch):
+    monkeypatch.setattr(app, "ZIP_MEMBER_MEMORY", 32 * 1024)
+    monkeypatch.setattr(app, "ZIP_READ_CHUNK", 16 * 1024)
+    small, large = os.urandom(1024), os.urandom(100 * 1024)
+    source = make_zip({"small.txt": small, "large.txt": large}, zipfile.ZIP_STORED)
+
+    members = dict(iter_zip_members(source))
+    assert isinstance(members["small.txt"], io.BytesIO)
+    path = members["large.txt"]
+    with open(path, "rb") as f:
+        assert f.read() == large
+
+    release_zip_member(members["small.txt"])
+    release_zip_member(path)
+    assert not os.path.exists(path)
+
+def test_rejected_member_leaves_no_temp_file(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "ZIP_MEMBER_MEMORY", 16 * 1024)
+    monkeypatch.setattr(app, "ZIP_READ_CHUNK", 16 * 1024)
+    monkeypatch.setattr(app, "MAX_DOCUMENT_SIZE", 64 * 1024)
+    monkeypatch.setattr(app.tempfile, "tempdir", str(tmp_path))
+    source = make_zip({"big.txt": os.urandom(128 * 1024)}, zipfile.ZIP_STORED)
+
+    with pytest.raises(ArchiveError):
+        read_members(source)
+    assert list(tmp_path.iterdir()) == []
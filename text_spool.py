@@ -0,0 +1,172 @@
+import os
+import sys
+import mmap
+import tempfile
+import resource
+
+# Configuration
+SPILL_THRESHOLD = int(os.getenv("SPILL_THRESHOLD", 32 * 1024 * 1024))  # 32MB of text per request
+
+class TextSpool:
+    """Append-only store of text chunks that spills to a temp file past a threshold.
+
+    Chunks stay in memory until their total size passes spill_threshold, then
+    everything moves to a temp file that is read back through a memory map.
+    Each chunk carries a small metadata dict (source document, page).
+    """
+
+    def __init__(self, spill_threshold=SPILL_THRESHOLD, directory=None):
+        self.spill_threshold = spill_threshold
+        self.directory = directory
+        self.document_count = 0
+        self.text_bytes = 0
+        self.path = None
+        self._chunks = []  # (text, metadata) while in memory
+        self._offsets = []  # (start, end, metadata) once spilled
+        self._memory_bytes = 0
+        self._file = None
+        self._mmap = None
+
+    @property
+    def spilled(self):
+        return self.path is not None
+
+    def __len__(self):
+        return len(self._offsets) if self.spilled else len(self._chunks)
+
+    def write(self, text, metadata=None):
+        """Append one chunk"""
+        if not text:
+            return
+        data_size = len(text.encode('utf-8'))
+        self.text_bytes += data_size
+
+        if self.spilled:
+            self._append_to_file(text, metadata)
+            return
+
+        self._chunks.append((text, metadata or {}))
+        self._memory_bytes += data_size
+        if self._memory_bytes > self.spill_threshold:
+            self._spill()
+
+    def _spill(self):
+        fd, self.path = tempfile.mkstemp(prefix="spool_", suffix=".txt", dir=self.directory)
+        self._file = os.fdopen(fd, 'wb')
+        chunks, self._chunks, self._memory_bytes = self._chunks, [], 0
+        for text, metadata in chunks:
+            self._append_to_file(text, metadata)
+
+    def _append_to_file(self, text, metadata):
+        if self._file is None:
+            raise ValueError("TextSpool is finalized")
+        data = text.encode('utf-8')
+        start = self._file.tell()
+        self._file.write(data)
+        self._offsets.append((start, start + len(data), metadata or {}))
+
+    def finalize(self):
+        """Stop writing; spilled text becomes readable through a memory map"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        return self
+
+    def extend(self, other):
+        """Append every chunk of another spool"""
+        for text, metadata in other.iter_records():
+            self.write(text, metadata)
+        self.document_count += other.document_count
+
+    def iter_records(self):
+        """Yield (text, metadata) for each chunk, in write order"""
+        if not self.spilled:
+            yield from self._chunks
+            return
+
+        self.finalize()
+        if self._mmap is None:
+            with open(self.path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        for start, end, metadata in self._offsets:
+            yield self._mmap[start:end].decode('utf-8'), metadata
+
+    def iter_chunks(self):
+        """Yield the text of each chunk, in write order"""
+        for text, _ in self.iter_records():
+            yield text
+
+    def head(self, limit, separator="\n\n"):
+        """The first `limit` characters of the chunks joined by separator"""
+        parts = []
+        size = 0
+        for chunk in self.iter_chunks():
+            parts.append(chunk)
+            size += len(chunk) + len(separator)
+            if size >= limit:
+                break
+        return separator.join(parts)[:limit]
+
+    def close(self):
+        """Release the memory map and delete the spill file"""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self.finalize()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self._chunks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getstate__(self):
+        # Spools cross process boundaries (extraction workers); send only data
+        self.finalize()
+        state = self.__dict__.copy()
+        state['_file'] = None
+        state['_mmap'] = None
+        return state
+
+def merge_spools(spools, spill_threshold=SPILL_THRESHOLD):
+    """Concatenate spools into a new one, closing the parts as they are copied"""
+    merged = TextSpool(spill_threshold)
+    try:
+        for part in spools:
+            with part:
+                merged.extend(part)
+    except BaseException:
+        merged.close()
+        raise
+    return merged.finalize()
+
+def process_rss_mb(pid="self"):
+    """Current resident set size of a process in MB, None where /proc is unavailable"""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        return None
+
+def memory_usage(worker_pids=()):
+    """Resident set size of this process, and of its worker processes if given, in MB.
+
+    process_peak_rss_mb is the high-water mark since the process started,
+    not a per-request figure.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    peak_mb = peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    current_mb = process_rss_mb()
+
+    usage = {
+        "rss_mb": round(current_mb, 1) if current_mb is not None else None,
+        "process_peak_rss_mb": round(peak_mb, 1)
+    }
+    if worker_pids:
+        workers = [process_rss_mb(pid) for pid in worker_pids]
+        usage["workers_rss_mb"] = round(sum(rss for rss in workers if rss is not None), 1)
+    return usage
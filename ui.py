@@ -1,15 +1,9 @@
 import streamlit as st
 import requests
-import tempfile
 import traceback
-import xml.etree.ElementTree as ET
-import json
 import time
 import os
-import shutil
-import zipfile
-from docx import Document as DocxDocument
-from fpdf import FPDF
+import hashlib
 from io import BytesIO
 from typing import List, Dict, Any, Optional
 
@@ -18,6 +12,11 @@ BACKEND_URL = os.getenv("BACKEND_URL", "http://127.0.0.1:5001")
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB per file
 SUPPORTED_EXTENSIONS = ['.pdf', '.docx', '.txt', '.csv', '.xlsx']
 CONFIG_EXTENSIONS = ['yaml', 'yml', 'json']
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # 8MB per chunk
+UPLOAD_RETRIES = 3
+UPLOAD_BUSY_RETRIES = 10  # 409s while another PUT still holds the upload
+# Download label -> backend export format
+EXPORT_FORMATS = {"JSON": "json", "Text": "text", "XML": "xml", "DOCX": "docx", "PDF": "pdf", "CSV": "csv"}
 
 st.set_page_config(page_title="Document Analyzer", layout="wide")
 st.title("Document Analyzer")
@@ -33,11 +32,10 @@ def init_session_state():
         'session_id': None,
         'config_uploaded': False,
         'uploaded_configs': [],
-        'temp_dir': None,
-        'extracted_files': [],
         'analysis_complete': False,
         'show_results': False,
         'extraction_results': {},
+        'result_id': None,
         'text_sample': ''
     }
     
@@ -45,18 +43,8 @@ def init_session_state():
         if key not in st.session_state:
             st.session_state[key] = default_value
 
-def cleanup_temp_directory():
-    """Clean up temporary directory"""
-    if st.session_state.temp_dir and os.path.exists(st.session_state.temp_dir):
-        try:
-            shutil.rmtree(st.session_state.temp_dir)
-            st.session_state.temp_dir = None
-        except Exception as e:
-            st.warning(f"Could not clean up temporary directory: {str(e)}")
-
 def reset_session():
     """Reset all session state variables"""
-    cleanup_temp_directory()
     for key in list(st.session_state.keys()):
         if key.startswith('form_'):  # Keep form keys
             continue
@@ -69,55 +57,6 @@ def validate_file_size(file) -> bool:
         return False
     return True
 
-def extract_zip_files(zip_file) -> List[str]:
-    """Extract ZIP file and return list of valid document paths"""
-    try:
-        if not st.session_state.temp_dir:
-            st.session_state.temp_dir = tempfile.mkdtemp()
-        
-        # Save uploaded ZIP file
-        zip_path = os.path.join(st.session_state.temp_dir, "uploaded.zip")
-        with open(zip_path, "wb") as f:
-            f.write(zip_file.getvalue())
-        
-        # Extract ZIP file
-        extract_dir = os.path.join(st.session_state.temp_dir, "extracted")
-        os.makedirs(extract_dir, exist_ok=True)
-        
-        extracted_files = []
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            # Check for zip bombs or excessive files
-            file_list = zip_ref.namelist()
-            if len(file_list) > 100:  # Limit number of files
-                st.warning("ZIP contains too many files (max 100)")
-                return []
-            
-            for file_info in zip_ref.infolist():
-                # Skip directories and hidden files
-                if file_info.is_dir() or file_info.filename.startswith('.'):
-                    continue
-                
-                # Check file extension
-                file_ext = os.path.splitext(file_info.filename.lower())[1]
-                if file_ext in SUPPORTED_EXTENSIONS:
-                    # Check file size
-                    if file_info.file_size > MAX_FILE_SIZE:
-                        st.warning(f"Skipping {file_info.filename} - file too large")
-                        continue
-                    
-                    # Extract file
-                    zip_ref.extract(file_info, extract_dir)
-                    extracted_files.append(os.path.join(extract_dir, file_info.filename))
-        
-        return extracted_files
-        
-    except zipfile.BadZipFile:
-        st.error("Invalid ZIP file")
-        return []
-    except Exception as e:
-        st.error(f"Error extracting ZIP: {str(e)}")
-        return []
-
 def upload_config_files(config_files) -> bool:
     """Upload configuration files to backend"""
     try:
@@ -171,25 +110,124 @@ def upload_config_files(config_files) -> bool:
         st.error(f"❌ Error processing config files: {str(e)}")
         return False
 
-def process_documents(files_data: List[tuple], session_id: str) -> bool:
-    """Process documents with backend"""
+def file_sha256(file) -> str:
+    """Hash an uploaded file chunk by chunk without copying it"""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for block in iter(lambda: file.read(UPLOAD_CHUNK_SIZE), b''):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+def file_length(file) -> int:
+    """Size of an uploaded file in bytes"""
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(0)
+    return size
+
+def upload_file_chunked(file, session_id: str, progress: Optional[Any] = None) -> str:
+    """Upload one file in chunks, resuming where the backend left off; returns the upload ID"""
+    size = file_length(file)
+    response = requests.post(
+        f"{BACKEND_URL}/uploads",
+        json={
+            "session_id": session_id,
+            "filename": file.name,
+            "size": size,
+            "sha256": file_sha256(file)
+        },
+        timeout=30
+    )
+    response.raise_for_status()
+    upload = response.json()
+    
+    # Already on the server (dedup) or resumed from a previous attempt
+    failures = 0
+    busy = 0
+    while upload["status"] != "complete":
+        offset = upload["received"]
+        file.seek(offset)
+        chunk = file.read(UPLOAD_CHUNK_SIZE)
+        
+        try:
+            response = requests.put(
+                f"{BACKEND_URL}/uploads/{upload['upload_id']}",
+                params={"offset": offset},
+                data=chunk,
+                headers={"Content-Type": "application/octet-stream"},
+                timeout=60
+            )
+            if response.status_code == 409:
+                # Out of sync with the server: continue from its offset
+                upload = response.json()
+                if upload["status"] == "receiving":
+                    # An earlier PUT (e.g. one that timed out here) is still being written
+                    busy += 1
+                    if busy > UPLOAD_BUSY_RETRIES:
+                        raise RuntimeError(f"Upload of {file.name} is stuck, try again later")
+                    time.sleep(min(0.25 * 2 ** busy, 5))
+                continue
+            if response.status_code == 422:
+                # Checksum mismatch, the server restarted the upload
+                upload = requests.get(f"{BACKEND_URL}/uploads/{upload['upload_id']}", timeout=30).json()
+                continue
+            response.raise_for_status()
+            upload = response.json()
+            failures = 0
+            busy = 0
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.HTTPError):
+            failures += 1
+            if failures > UPLOAD_RETRIES:
+                raise
+            time.sleep(2 ** failures)
+            upload = requests.get(f"{BACKEND_URL}/uploads/{upload['upload_id']}", timeout=30).json()
+        
+        if progress:
+            progress(upload["received"], size)
+    
+    return upload["upload_id"]
+
+def upload_documents_chunked(files: List[Any], session_id: str) -> List[str]:
+    """Upload a batch of files one chunk at a time; returns their upload IDs"""
+    upload_ids = []
+    bar = st.progress(0.0, text="Uploading documents...")
+    
+    for i, file in enumerate(files):
+        def progress(received, size, i=i, name=file.name):
+            done = (i + received / max(size, 1)) / len(files)
+            bar.progress(done, text=f"Uploading {name} ({i + 1}/{len(files)})")
+        
+        upload_ids.append(upload_file_chunked(file, session_id, progress))
+    
+    bar.progress(1.0, text=f"✅ Uploaded {len(files)} file(s)")
+    return upload_ids
+
+def process_documents(upload_ids: List[str], session_id: str) -> bool:
+    """Process uploaded documents with backend"""
     try:
         with st.status("Analyzing documents...") as status:
             response = requests.post(
                 f"{BACKEND_URL}/upload_documents",
-                files=files_data,
-                data={"session_id": session_id},
+                data={"session_id": session_id, "upload_ids": upload_ids},
                 timeout=300  # 5 minutes for large documents
             )
             
             if response.status_code == 200:
                 result = response.json()
                 st.session_state.extraction_results = result.get("data", {})
+                st.session_state.result_id = result.get("result_id")
                 st.session_state.text_sample = result.get("text_sample", "")
                 st.session_state.analysis_complete = True
                 st.session_state.show_results = False
                 status.update(label="✅ Analysis complete!", state="complete")
                 return True
+            elif response.status_code == 429:
+                retry_after = response.headers.get("Retry-After", "a few")
+                status.update(label="⏳ Server busy", state="error")
+                st.warning(f"Server is at capacity. Please retry in {retry_after} seconds.")
+                return False
             else:
                 st.error(f"❌ Backend error: {response.text}")
                 return False
@@ -204,6 +242,27 @@ def process_documents(files_data: List[tuple], session_id: str) -> bool:
         st.error(f"❌ Analysis failed: {str(e)}")
         return False
 
+@st.cache_data(show_spinner=False, max_entries=64)
+def fetch_export(result_id: str, export_format: str) -> tuple:
+    """Download a rendered export from the backend; cached so reruns are free.
+
+    Returns (data, mime type, filename), with the filename and its extension
+    taken from the backend's Content-Disposition header.
+    """
+    buffer = BytesIO()
+    with requests.get(
+        f"{BACKEND_URL}/results/{result_id}/export/{export_format}",
+        stream=True,
+        timeout=60
+    ) as response:
+        response.raise_for_status()
+        for block in response.iter_content(chunk_size=256 * 1024):
+            buffer.write(block)
+        mime = response.headers.get("Content-Type", "application/octet-stream")
+        disposition = response.headers.get("Content-Disposition", "")
+    filename = disposition.split("filename=")[-1].strip('"') if "filename=" in disposition \
+        else f"extraction_results.{export_format}"
+    return buffer.getvalue(), mime, filename
 
 # Initialize session state
 init_session_state()
@@ -272,6 +331,7 @@ if st.session_state.config_uploaded:
     
     # Initialize variables
     uploaded_files = None
+    zip_file = None
     files_ready = False
     
     if upload_option == "Individual Files":
@@ -307,15 +367,9 @@ if st.session_state.config_uploaded:
             if not validate_file_size(zip_file):
                 st.error(f"ZIP file too large (max {MAX_FILE_SIZE//1024//1024}MB)")
             else:
-                with st.spinner("📦 Extracting ZIP file..."):
-                    extracted_files = extract_zip_files(zip_file)
-                    
-                if extracted_files:
-                    st.session_state.extracted_files = extracted_files
-                    st.success(f"✅ Extracted {len(extracted_files)} document(s)")
-                    files_ready = True
-                else:
-                    st.error("No valid documents found in ZIP archive")
+                # The backend unpacks and validates the archive itself
+                st.success(f"✅ ZIP archive ready: {zip_file.name}")
+                files_ready = True
 
     # Process documents when ready
     if files_ready:
@@ -333,27 +387,29 @@ if st.session_state.config_uploaded:
             )
         
         if st.button("🔍 Analyze Documents", type="primary"):
-            # Prepare files for upload
-            files_data = []
+            # Prepare files for upload; the ZIP archive is sent as-is
+            files_to_upload = []
+            if upload_option == "Individual Files" and uploaded_files:
+                files_to_upload = uploaded_files
+            elif upload_option == "ZIP Archive" and zip_file:
+                files_to_upload = [zip_file]
             
-            try:
-                if upload_option == "Individual Files" and uploaded_files:
-                    for file in uploaded_files:
-                        files_data.append(("document_files", (file.name, file.getvalue())))
-                        
-                elif upload_option == "ZIP Archive" and st.session_state.extracted_files:
-                    for file_path in st.session_state.extracted_files:
-                        if os.path.exists(file_path):
-                            with open(file_path, 'rb') as f:
-                                files_data.append(("document_files", (os.path.basename(file_path), f.read())))
+            if files_to_upload:
+                try:
+                    # Chunked and resumable: re-clicking after a failure skips
+                    # whatever the backend already has
+                    upload_ids = upload_documents_chunked(files_to_upload, selected_session_id)
+                except requests.exceptions.ConnectionError:
+                    upload_ids = []
+                    st.error("❌ Backend connection failed during upload. Click Analyze again to resume.")
+                except Exception as e:
+                    upload_ids = []
+                    st.error(f"❌ Upload failed: {str(e)}. Click Analyze again to resume.")
                 
-                if files_data:
-                    process_documents(files_data, selected_session_id)
-                else:
-                    st.error("No files to process")
-                    
-            except Exception as e:
-                st.error(f"Error preparing files: {str(e)}")
+                if upload_ids:
+                    process_documents(upload_ids, selected_session_id)
+            else:
+                st.error("No files to process")
 
 # Step 3: Results Section
 if st.session_state.analysis_complete:
@@ -410,119 +466,39 @@ if st.session_state.analysis_complete:
                     st.info("No results to display")
                     
             elif output_format == "XML":
-                root = ET.Element("AnalysisResults")
-                if "results" in st.session_state.extraction_results:
-                    for item in st.session_state.extraction_results["results"]:
-                        result_elem = ET.SubElement(root, "Result")
-                        ET.SubElement(result_elem, "Field").text = str(item.get('field', ''))
-                        ET.SubElement(result_elem, "Type").text = str(item.get('type', ''))
-                        ET.SubElement(result_elem, "Confidence").text = str(item.get('confidence', ''))
-                        ET.SubElement(result_elem, "Value").text = str(item.get('value', ''))
-                
-                xml_str = ET.tostring(root, encoding='unicode')
-                st.code(xml_str, language="xml")
+                if st.session_state.result_id:
+                    xml_bytes, _, _ = fetch_export(st.session_state.result_id, "xml")
+                    st.code(xml_bytes.decode('utf-8'), language="xml")
+                else:
+                    st.info("No results to display")
             
                 
         except Exception as e:
             st.error(f"Error displaying results: {str(e)}")
         
-        # Download section
+        # Download section: rendered by the backend, cached per result
         st.subheader("💾 Download Results")
         d1_col1, d1_col2 = st.columns(2)
-        file_data = None
-        filename = ""
-        mime = ""
 
         try:
-
             with d1_col1:
-                if st.button("Download as JSON"):
-                    file_data = json.dumps(st.session_state.extraction_results, indent=2).encode('utf-8')
-                    filename = "extraction_results.json"
-                    mime = "application/json"
-
-                if st.button("Download as Text"):
-                    text_content = ""
-                    if "results" in st.session_state.extraction_results:
-                        for i, item in enumerate(st.session_state.extraction_results["results"], 1):
-                            text_content += f"Result {i}:\n"
-                            text_content += f"Field: {item.get('field', 'N/A')}\n"
-                            text_content += f"Type: {item.get('type', 'N/A')}\n"
-                            text_content += f"Confidence: {item.get('confidence', 'N/A')}\n"
-                            text_content += f"Value: {item.get('value', 'N/A')}\n"
-                            text_content += "-" * 50 + "\n\n"
-                    file_data = text_content.encode('utf-8')
-                    filename = "extraction_results.txt"
-                    mime = "text/plain"
-
-                if st.button("Download as XML"):
-                    root = ET.Element("AnalysisResults")
-                    if "results" in st.session_state.extraction_results:
-                        for item in st.session_state.extraction_results["results"]:
-                            result_elem = ET.SubElement(root, "Result")
-                            ET.SubElement(result_elem, "Field").text = str(item.get('field', ''))
-                            ET.SubElement(result_elem, "Type").text = str(item.get('type', ''))
-                            ET.SubElement(result_elem, "Confidence").text = str(item.get('confidence', ''))
-                            ET.SubElement(result_elem, "Value").text = str(item.get('value', ''))
-                    
-                    xml_str = ET.tostring(root, encoding='unicode')
-                    file_data = xml_str.encode('utf-8')
-                    filename = "extraction_results.xml"
-                    mime = "application/xml"
-                    
-                if st.button("Download as DOCX"):
-                    result_data = st.session_state.get("extraction_results", {})
-                    output = BytesIO()
-                    doc = DocxDocument()
-                    doc.add_heading("Extracted Data", level=1)
-                    for item in result_data["results"]:
-                        doc.add_paragraph(f"{item['field']}: {item['value']}")  # Key-value pair
-                    doc.save(output)
-                    output.seek(0)
-                    file_data = output.getvalue()
-                    mime = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-                    filename = "extraction_results.docx"
-
-                if st.button("Download as PDF"):
-                    result_data = st.session_state.get("extraction_results", {})
-                    output = BytesIO()
-                    pdf = FPDF()
-                    pdf.add_page()
-                    pdf.set_font("Arial", size=12)
-
-                    for item in result_data["results"]:
-                        field = item['field']
-                        value = item['value']
-                        # Safely encode for PDF
-                        safe_value = str(value).encode('latin-1', 'replace').decode('latin-1')
-                        pdf.multi_cell(0, 10, f"{field}: {safe_value}")
-
-                    # Write PDF content to BytesIO
-                    pdf_output = pdf.output(dest='S').encode('latin-1')
-                    output.write(pdf_output)
-                    output.seek(0)
-                    file_data = output.getvalue()
-                    mime = "application/pdf"
-                    filename = "extraction_results.pdf"
+                download_format = st.selectbox(
+                    "Download format:",
+                    list(EXPORT_FORMATS),
+                    key="download_format"
+                )
 
             with d1_col2:
-                if file_data:
+                if st.session_state.result_id:
+                    file_data, mime, filename = fetch_export(st.session_state.result_id,
+                                                             EXPORT_FORMATS[download_format])
                     st.download_button("Click to save", file_data, filename, mime=mime)
-            
+                else:
+                    st.info("Results are not available for download")
                 
         except Exception as e:
             st.error(f"Error preparing downloads: {str(e)}")
 
-# Cleanup on exit
-if st.session_state.get('temp_dir') and os.path.exists(st.session_state.temp_dir):
-    try:
-        # Only cleanup if not actively using temp files
-        if not st.session_state.extracted_files:
-            shutil.rmtree(st.session_state.temp_dir)
-            st.session_state.temp_dir = None
-    except:
-        pass
-
 # Footer
 st.markdown("---")
 st.markdown("""